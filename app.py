@@ -1,11 +1,19 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, abort
 from flask_cors import CORS
 import os
 import json
-from werkzeug.utils import secure_filename
+import math
+import mimetypes
+import threading
+from werkzeug.security import safe_join
 from knowledge_graph import KnowledgeGraphBuilder
-from visualizations import GraphVisualizer
-from graph_analytics import GraphAnalytics
+from visualizations import GraphVisualizer, LAYOUT_TYPES, WORDCLOUD_FORMATS
+from graph_analytics import GraphAnalytics, AnalyticsService, assemble_results, expand_metrics
+from graph_store import GraphStore
+from graph_index import GraphIndex
+from graph_versions import VersionedGraphStore, diff_graphs, count_changes, document_key, PROVENANCE_FIELDS
+from vector_index import EntityVectorIndex
+from embeddings import get_embedding_cache
 import traceback
 
 app = Flask(__name__)
@@ -19,14 +27,108 @@ ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['LOD_NODE_THRESHOLD'] = 2000  # 超过该实体数时自动使用社区总览（分层可视化）
 
 # 确保文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# 图谱存储（按内容哈希保存，并缓存查询索引等派生数据）
+graph_store = GraphStore(OUTPUT_FOLDER)
+# 按文档保存的图谱版本（段落级增量抽取）
+version_store = VersionedGraphStore(OUTPUT_FOLDER)
+# 图谱分析服务（首次使用时创建进程池）
+analytics_service = None
+# 跨图谱的实体向量索引（首次使用时加载）
+vector_index = None
+# 多线程并发请求时，保证上面的服务只创建一次
+service_lock = threading.Lock()
+# 并发构建时串行写入 outputs/graph.json
+graph_file_lock = threading.Lock()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def resolve_graph_id(data):
+    """从请求中获取图谱ID；只提供 graph_data 时先保存图谱"""
+    graph_id = data.get('graph_id')
+    if graph_id:
+        return graph_id if graph_store.exists(graph_id) else None
+    graph_data = data.get('graph_data')
+    if graph_data:
+        return graph_store.save(graph_data)
+    return None
+
+def get_graph_index(graph_id):
+    """获取图谱查询索引（每个图谱只构建一次）"""
+    return graph_store.get_artifact(graph_id, 'index', GraphIndex)
+
+def get_community_aggregates(graph_id):
+    """获取社区聚合数据（每个图谱只计算一次，并持久化到磁盘）"""
+    return graph_store.get_artifact(
+        graph_id, 'communities', GraphAnalytics().community_aggregates, persist=True
+    )
+
+def get_analytics_service():
+    global analytics_service
+    with service_lock:
+        if analytics_service is None:
+            analytics_service = AnalyticsService()
+        return analytics_service
+
+def get_vector_index():
+    global vector_index
+    with service_lock:
+        if vector_index is None:
+            vector_index = EntityVectorIndex(OUTPUT_FOLDER)
+        return vector_index
+
+def read_upload(filename):
+    """读取已上传文件的文本，文件不存在时返回None"""
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def build_response(graph_data, build_info):
+    """保存构建好的图谱、加入向量索引，并生成接口响应数据"""
+    graph_file = os.path.join(app.config['OUTPUT_FOLDER'], 'graph.json')
+    with graph_file_lock, open(graph_file, 'w', encoding='utf-8') as f:
+        json.dump(graph_data, f, ensure_ascii=False, indent=2)
+    graph_id = graph_store.save(graph_data)
+
+    # 实体加入向量索引；索引失败不影响图谱构建结果
+    try:
+        get_vector_index().add_graph(graph_id, graph_data, get_embedding_cache().encode)
+    except Exception:
+        traceback.print_exc()
+
+    return {
+        'success': True,
+        'graph_id': graph_id,
+        'version': build_info['version'],
+        'build_info': build_info,
+        'graph_data': graph_data
+    }
+
+def analytics_response(outcome):
+    """把分析服务的结果转换为接口响应"""
+    return jsonify({
+        'success': True,
+        'graph_id': outcome['graph_id'],
+        'analytics': assemble_results(outcome['results']),
+        'pending': outcome['pending'],
+        'missing': outcome['missing'],
+        'errors': outcome['errors']
+    })
+
+def use_lod(lod, graph_data):
+    """判断是否使用分层可视化：lod 可为 true/false/'auto'"""
+    if lod == 'auto':
+        return len(graph_data.get('nodes', [])) > app.config['LOD_NODE_THRESHOLD']
+    return bool(lod)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -43,7 +145,8 @@ def upload_file():
             return jsonify({'error': '文件名为空'}), 400
 
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
+            # 中文文件名经 secure_filename 处理后会丢失，document_key 保证不同文件名不会冲突
+            filename = document_key(file.filename)
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
 
@@ -85,30 +188,18 @@ def build_graph():
         if not filename:
             return jsonify({'error': '缺少文件名'}), 400
 
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if not os.path.exists(filepath):
+        text = read_upload(filename)
+        if text is None:
             return jsonify({'error': '文件不存在'}), 404
 
-        # 读取文本
-        with open(filepath, 'r', encoding='utf-8') as f:
-            text = f.read()
-
-        # 构建知识图谱
+        # 构建知识图谱（只重新抽取修改过的段落）
         builder = KnowledgeGraphBuilder()
-        graph_data = builder.build(text)
+        graph_data, build_info = builder.build_incremental(text, version_store, filename)
 
         if not graph_data:
             return jsonify({'error': '图谱构建失败'}), 500
 
-        # 保存图谱数据
-        graph_file = os.path.join(app.config['OUTPUT_FOLDER'], 'graph.json')
-        with open(graph_file, 'w', encoding='utf-8') as f:
-            json.dump(graph_data, f, ensure_ascii=False, indent=2)
-
-        return jsonify({
-            'success': True,
-            'graph_data': graph_data
-        })
+        return jsonify(build_response(graph_data, build_info))
 
     except Exception as e:
         traceback.print_exc()
@@ -125,9 +216,29 @@ def visualize():
 
         if not graph_data:
             return jsonify({'error': '缺少图谱数据'}), 400
+        if layout not in LAYOUT_TYPES:
+            return jsonify({'error': '不支持的布局算法'}), 400
 
         visualizer = GraphVisualizer()
 
+        if viz_type in ('interactive_2d', 'interactive_3d') and use_lod(data.get('lod', 'auto'), graph_data):
+            graph_id = resolve_graph_id(data)
+            if not graph_id:
+                return jsonify({'error': '图谱不存在'}), 404
+            html_file = visualizer.create_community_overview(
+                graph_data,
+                get_community_aggregates(graph_id),
+                graph_id,
+                dimensions=3 if viz_type == 'interactive_3d' else 2,
+                layout=layout
+            )
+            return jsonify({
+                'success': True,
+                'type': 'html',
+                'path': html_file,
+                'lod': True
+            })
+
         if viz_type == 'interactive_2d':
             html_file = visualizer.create_interactive_2d(graph_data, layout)
             return jsonify({
@@ -150,7 +261,13 @@ def visualize():
                 'path': img_file
             })
         elif viz_type == 'wordcloud':
-            img_file = visualizer.create_entity_wordcloud(graph_data)
+            fmt = data.get('format', 'png')
+            if fmt not in WORDCLOUD_FORMATS:
+                return jsonify({'error': '不支持的图片格式'}), 400
+            dpi = min(max(int(data.get('dpi', 100)), 50), 300)
+            width = min(max(float(data.get('width', 12)), 2), 30)
+            height = min(max(float(data.get('height', 8)), 2), 30)
+            img_file = visualizer.create_entity_wordcloud(graph_data, size=(width, height), dpi=dpi, fmt=fmt)
             return jsonify({
                 'success': True,
                 'type': 'image',
@@ -163,32 +280,309 @@ def visualize():
         traceback.print_exc()
         return jsonify({'error': f'可视化失败: {str(e)}'}), 500
 
+@app.route('/api/visualize/community', methods=['POST'])
+def visualize_community():
+    """分层可视化：展开单个社区的内部子图"""
+    try:
+        data = request.get_json()
+        graph_id = data.get('graph_id')
+        if not graph_store.exists(graph_id):
+            return jsonify({'error': '图谱不存在'}), 404
+
+        dimensions = int(data.get('dimensions', 2))
+        if dimensions not in (2, 3):
+            return jsonify({'error': '不支持的维度'}), 400
+        layout = data.get('layout', 'semantic')
+        if layout not in LAYOUT_TYPES:
+            return jsonify({'error': '不支持的布局算法'}), 400
+
+        html_file = GraphVisualizer().create_community_detail(
+            graph_store.load(graph_id),
+            get_community_aggregates(graph_id),
+            graph_id,
+            int(data.get('community_id', 0)),
+            dimensions=dimensions,
+            layout=layout
+        )
+        if html_file is None:
+            return jsonify({'error': '社区不存在'}), 404
+
+        return jsonify({
+            'success': True,
+            'type': 'html',
+            'path': html_file
+        })
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'展开社区失败: {str(e)}'}), 500
+
 @app.route('/api/analytics', methods=['POST'])
 def analytics():
-    """图谱分析"""
+    """
+    图谱分析
+
+    请求可用 metrics 指定需要的指标（默认全部），budget 指定最长等待秒数；
+    超时未完成的指标列在 pending 中，之后可通过 /api/analytics/result 获取。
+    """
     try:
         data = request.get_json()
         graph_data = data.get('graph_data')
+        if not graph_data and data.get('graph_id'):
+            graph_data = graph_store.load(data['graph_id'])
 
         if not graph_data:
             return jsonify({'error': '缺少图谱数据'}), 400
 
-        analyzer = GraphAnalytics()
-        analysis_results = analyzer.analyze(graph_data)
+        budget = data.get('budget')
+        if budget is not None:
+            try:
+                budget = float(budget)
+            except (TypeError, ValueError):
+                budget = -1
+            if not math.isfinite(budget) or budget < 0:
+                return jsonify({'error': 'budget 必须是非负的秒数'}), 400
+
+        try:
+            metrics = expand_metrics(data.get('metrics'))
+        except ValueError as e:
+            return jsonify({'error': f'不支持的分析指标: {str(e)}'}), 400
+
+        outcome = get_analytics_service().request(graph_data, metrics=metrics, budget=budget)
+        return analytics_response(outcome)
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'分析失败: {str(e)}'}), 500
+
+@app.route('/api/analytics/result', methods=['POST'])
+def analytics_result():
+    """获取此前超时未完成（pending）的分析指标"""
+    try:
+        data = request.get_json()
+        graph_id = data.get('graph_id')
+        if not graph_id:
+            return jsonify({'error': '缺少图谱ID'}), 400
+
+        return analytics_response(get_analytics_service().get(graph_id, data.get('metrics')))
+
+    except ValueError as e:
+        return jsonify({'error': f'不支持的分析指标: {str(e)}'}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'获取分析结果失败: {str(e)}'}), 500
+
+@app.route('/api/graph/versions', methods=['POST'])
+def graph_versions():
+    """列出文档的图谱版本"""
+    try:
+        data = request.get_json()
+        filename = data.get('filename')
+        if not filename:
+            return jsonify({'error': '缺少文件名'}), 400
 
         return jsonify({
             'success': True,
-            'analytics': analysis_results
+            'versions': version_store.list_versions(filename)
         })
 
     except Exception as e:
         traceback.print_exc()
-        return jsonify({'error': f'分析失败: {str(e)}'}), 500
+        return jsonify({'error': f'获取版本失败: {str(e)}'}), 500
+
+@app.route('/api/graph/diff', methods=['POST'])
+def graph_diff():
+    """比较文档的两个图谱版本：新增、删除和修改的实体与关系"""
+    try:
+        data = request.get_json()
+        filename = data.get('filename')
+        if not filename:
+            return jsonify({'error': '缺少文件名'}), 400
+
+        head = version_store.head(filename)
+        if not head:
+            return jsonify({'error': '文档尚未构建图谱'}), 404
+
+        to_version = int(data.get('to_version', head['version']))
+        from_version = int(data.get('from_version', to_version - 1))
+
+        new_graph = version_store.load_version(filename, to_version)
+        # 版本0表示空图谱
+        old_graph = {'nodes': [], 'edges': []} if from_version == 0 else version_store.load_version(filename, from_version)
+        if new_graph is None or old_graph is None:
+            return jsonify({'error': '版本不存在'}), 404
+
+        # 来源段落的变化不算作实体或关系的修改
+        diff = diff_graphs(old_graph, new_graph, ignore_fields=PROVENANCE_FIELDS)
+        return jsonify({
+            'success': True,
+            'from_version': from_version,
+            'to_version': to_version,
+            'summary': count_changes(diff),
+            'diff': diff
+        })
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'版本比较失败: {str(e)}'}), 500
+
+@app.route('/api/graph/search', methods=['POST'])
+def graph_search():
+    """按实体名称检索（前缀/子串）"""
+    try:
+        data = request.get_json()
+        graph_id = resolve_graph_id(data)
+        if not graph_id:
+            return jsonify({'error': '缺少图谱数据或图谱不存在'}), 404
+
+        query = data.get('query', '')
+        mode = data.get('mode', 'substring')
+        if mode not in ('prefix', 'substring'):
+            return jsonify({'error': '不支持的检索模式'}), 400
+
+        result = get_graph_index(graph_id).search(
+            query,
+            mode=mode,
+            types=data.get('types'),
+            offset=data.get('offset', 0),
+            limit=min(int(data.get('limit', 20)), 500)
+        )
+
+        return jsonify({'success': True, 'graph_id': graph_id, **result})
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'检索失败: {str(e)}'}), 500
+
+@app.route('/api/graph/neighborhood', methods=['POST'])
+def graph_neighborhood():
+    """提取实体的k跳邻域子图"""
+    try:
+        data = request.get_json()
+        graph_id = resolve_graph_id(data)
+        if not graph_id:
+            return jsonify({'error': '缺少图谱数据或图谱不存在'}), 404
+
+        direction = data.get('direction', 'both')
+        if direction not in ('out', 'in', 'both'):
+            return jsonify({'error': '不支持的方向参数'}), 400
+
+        result = get_graph_index(graph_id).neighborhood(
+            data.get('node_id'),
+            k=max(0, min(int(data.get('k', 1)), 6)),
+            types=data.get('types'),
+            relations=data.get('relations'),
+            direction=direction,
+            offset=data.get('offset', 0),
+            limit=min(int(data.get('limit', 200)), 5000)
+        )
+        if result is None:
+            return jsonify({'error': '实体不存在'}), 404
+
+        return jsonify({'success': True, 'graph_id': graph_id, **result})
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'邻域查询失败: {str(e)}'}), 500
+
+@app.route('/api/graph/path', methods=['POST'])
+def graph_path():
+    """两个实体间的加权最短路径"""
+    try:
+        data = request.get_json()
+        graph_id = resolve_graph_id(data)
+        if not graph_id:
+            return jsonify({'error': '缺少图谱数据或图谱不存在'}), 404
+
+        index = get_graph_index(graph_id)
+        source = data.get('source')
+        target = data.get('target')
+        if source not in index.nodes or target not in index.nodes:
+            return jsonify({'error': '实体不存在'}), 404
+
+        path = index.shortest_path(
+            source,
+            target,
+            directed=bool(data.get('directed', False)),
+            relations=data.get('relations')
+        )
+
+        return jsonify({
+            'success': True,
+            'graph_id': graph_id,
+            'found': path is not None,
+            'path': path
+        })
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'路径查询失败: {str(e)}'}), 500
+
+@app.route('/api/similar', methods=['POST'])
+def similar_entities():
+    """跨图谱检索与查询语义最相近的实体"""
+    try:
+        data = request.get_json()
+        query = (data.get('query') or '').strip()
+        if not query:
+            return jsonify({'error': '缺少查询内容'}), 400
+
+        index = get_vector_index()
+        graph_ids = set(data['graph_ids']) if data.get('graph_ids') else None
+        types = set(data['types']) if data.get('types') else None
+        filter_fn = None
+        if graph_ids or types:
+            filter_fn = lambda o: (not graph_ids or o[0] in graph_ids) and (not types or o[2] in types)
+
+        results = index.search(
+            get_embedding_cache().encode([query])[0],
+            k=max(1, min(int(data.get('k', 10)), 100)),
+            filter_fn=filter_fn
+        )
+
+        return jsonify({
+            'success': True,
+            'query': query,
+            'results': results,
+            'index': index.stats()
+        })
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'相似实体检索失败: {str(e)}'}), 500
 
 @app.route('/outputs/<path:filename>')
 def serve_output(filename):
-    """提供输出文件"""
-    return send_file(os.path.join(app.config['OUTPUT_FOLDER'], filename))
+    """
+    提供输出文件
+
+    支持 ETag/Last-Modified 条件请求和 Range 请求；客户端接受压缩时
+    优先返回预压缩的 .br/.gz 副本。带版本号的共享资源（assets/）长期缓存，
+    其余输出可能被覆盖，每次使用前需重新验证。
+    """
+    path = safe_join(os.path.abspath(app.config['OUTPUT_FOLDER']), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    # max_age 为 None 时 send_file 会设置 no-cache，强制客户端重新验证
+    max_age = 365 * 24 * 3600 if filename.startswith('assets/') else None
+
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        variant = path + suffix
+        if (encoding in request.accept_encodings and os.path.isfile(variant)
+                and os.path.getmtime(variant) >= os.path.getmtime(path)):
+            response = send_file(variant, mimetype=mimetype, conditional=True, etag=True, max_age=max_age)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=max_age)
+
+    response.vary.add('Accept-Encoding')
+    if max_age is not None:
+        response.cache_control.immutable = True
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
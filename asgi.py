@@ -0,0 +1,93 @@
+"""
+异步服务模式（ASGI）
+
+图谱构建接口使用异步LLM客户端，等待LLM期间不占用线程，单个进程可同时处理数百个构建请求；
+其余接口沿用 app.py 中的 Flask 视图，在独立线程池中执行，分析、可视化等计算不会阻塞事件循环。
+
+启动：
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+压测（本地模拟LLM，无需API密钥）：
+    python load_test.py --builds 300 --latency 2
+"""
+import asyncio
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as flask_app
+from knowledge_graph import KnowledgeGraphBuilder
+
+# 执行 Flask 视图（分析、可视化等CPU密集接口）的线程数
+WSGI_WORKERS = int(os.getenv('WSGI_WORKERS', 16))
+# 构建完成后保存图谱、写入向量索引的线程数
+BUILD_WORKERS = int(os.getenv('BUILD_WORKERS', 4))
+
+build_executor = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix='build')
+builder = None
+
+
+def get_builder():
+    """所有异步构建共用一个构建器（及其HTTP连接池）"""
+    global builder
+    if builder is None:
+        builder = KnowledgeGraphBuilder()
+    return builder
+
+
+async def build_graph(request):
+    """构建知识图谱（异步版本，参数和返回值与 app.py 中的接口一致）"""
+    try:
+        data = await request.json()
+        filename = data.get('filename')
+
+        if not filename:
+            return JSONResponse({'error': '缺少文件名'}, status_code=400)
+
+        text = await asyncio.to_thread(flask_app.read_upload, filename)
+        if text is None:
+            return JSONResponse({'error': '文件不存在'}, status_code=404)
+
+        # 等待LLM期间事件循环继续处理其他请求
+        graph_data, build_info = await get_builder().build_incremental_async(
+            text, flask_app.version_store, filename
+        )
+
+        if not graph_data:
+            return JSONResponse({'error': '图谱构建失败'}, status_code=500)
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(build_executor, flask_app.build_response, graph_data, build_info)
+        return JSONResponse(result)
+
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse({'error': f'构建图谱失败: {str(e)}'}, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(_):
+    yield
+    build_executor.shutdown(wait=False, cancel_futures=True)
+    if flask_app.analytics_service is not None:
+        flask_app.analytics_service.shutdown()
+
+
+application = Starlette(
+    routes=[
+        Route('/api/build_graph', build_graph, methods=['POST', 'OPTIONS'],
+              middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['POST'],
+                                     allow_headers=['*'])]),
+        # 其余接口交给 Flask 处理
+        Mount('/', app=WSGIMiddleware(flask_app.app, workers=WSGI_WORKERS))
+    ],
+    lifespan=lifespan
+)
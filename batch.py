@@ -0,0 +1,252 @@
+"""
+命令行批处理：构建 → 分析 → 可视化，无需启动 Flask 服务
+
+任务文件为 JSONL，每行一个任务，例如：
+    {"id": "doc1", "input": "texts/doc1.txt", "stages": ["build", "analyze", "render"]}
+    {"id": "doc2", "graph": "graphs/doc2.json", "stages": ["analyze", "render"], "render": ["interactive_2d", "wordcloud"]}
+    {"id": "doc3", "graph": "graphs/doc3.json", "stages": ["analyze"], "metrics": ["basic_stats", "centrality"]}
+
+用法：
+    python batch.py jobs.jsonl --output batch_outputs --workers 4
+
+结果逐条追加到 <output>/results.jsonl，产物保存在 <output>/<任务ID>/。
+重新运行时会跳过已成功完成的任务，可在中断后继续。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from graph_analytics import GraphAnalytics, expand_metrics
+
+STAGES = ('build', 'analyze', 'render')
+RENDER_TYPES = ('interactive_2d', 'interactive_3d', 'heatmap', 'wordcloud')
+
+# 每个工作进程内复用的对象（词向量模型和缓存在进程内共享）
+_worker = {}
+
+# 各数值计算库读取的线程数环境变量
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def _init_worker(output_dir, plotly_js_url, threads):
+    """
+    工作进程初始化：限制 torch 的计算线程数
+
+    BLAS 的线程数在导入 numpy 时就已确定，由主进程在创建进程池前通过环境变量设置。
+    """
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    _worker['output_dir'] = output_dir
+    _worker['plotly_js_url'] = plotly_js_url
+
+
+def _get_builder():
+    if 'builder' not in _worker:
+        from knowledge_graph import KnowledgeGraphBuilder
+        from graph_versions import VersionedGraphStore
+        _worker['builder'] = KnowledgeGraphBuilder()
+        _worker['version_store'] = VersionedGraphStore(_worker['output_dir'])
+    return _worker['builder'], _worker['version_store']
+
+
+def _get_analyzer():
+    if 'analyzer' not in _worker:
+        _worker['analyzer'] = GraphAnalytics()
+    return _worker['analyzer']
+
+
+def _read_text(path):
+    """读取文本，尝试多种编码"""
+    for encoding in ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']:
+        try:
+            with open(path, 'r', encoding=encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f'无法读取文件: {path}')
+
+
+def _write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def run_job(job):
+    """
+    在工作进程中执行单个任务
+
+    Returns:
+        dict: 结果记录
+    """
+    start = time.time()
+    job_id = job['id']
+    job_dir = os.path.join(_worker['output_dir'], job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    record = {'id': job_id, 'status': 'ok', 'stages': {}, 'artifacts': {}}
+    try:
+        graph_data = None
+        if job.get('graph'):
+            with open(job['graph'], 'r', encoding='utf-8') as f:
+                graph_data = json.load(f)
+
+        for stage in job['stages']:
+            stage_start = time.time()
+
+            if stage == 'build':
+                builder, version_store = _get_builder()
+                text = _read_text(job['input'])
+                # 以任务ID（已校验唯一）区分文档：不同任务的输入即使同名也互不影响，
+                # 也不会在多个工作进程间争用同一文档的版本文件
+                graph_data, build_info = builder.build_incremental(text, version_store, job_id)
+                if not graph_data:
+                    raise RuntimeError('图谱构建失败')
+                graph_file = os.path.join(job_dir, 'graph.json')
+                _write_json(graph_file, graph_data)
+                record['artifacts']['graph'] = graph_file
+                record['stages']['build'] = build_info
+
+            elif stage == 'analyze':
+                if graph_data is None:
+                    raise RuntimeError('缺少图谱数据，请先执行 build 或提供 graph')
+                analysis = _get_analyzer().analyze(graph_data, job.get('metrics'))
+                analytics_file = os.path.join(job_dir, 'analytics.json')
+                _write_json(analytics_file, analysis)
+                record['artifacts']['analytics'] = analytics_file
+                record['stages']['analyze'] = {'metrics': list(analysis)}
+
+            elif stage == 'render':
+                if graph_data is None:
+                    raise RuntimeError('缺少图谱数据，请先执行 build 或提供 graph')
+                from visualizations import GraphVisualizer
+                visualizer = GraphVisualizer(job_dir, plotly_js_url=_worker['plotly_js_url'])
+                layout = job.get('layout', 'semantic')
+                for viz_type in job.get('render', ['interactive_2d']):
+                    if viz_type == 'interactive_2d':
+                        path = visualizer.create_interactive_2d(graph_data, layout)
+                    elif viz_type == 'interactive_3d':
+                        path = visualizer.create_interactive_3d(graph_data, layout)
+                    elif viz_type == 'heatmap':
+                        path = visualizer.create_similarity_heatmap(graph_data)
+                    else:
+                        path = visualizer.create_entity_wordcloud(graph_data)
+                    record['artifacts'][viz_type] = path
+                record['stages']['render'] = {}
+
+            record['stages'].setdefault(stage, {})['elapsed'] = round(time.time() - stage_start, 3)
+
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = str(e)
+        record['traceback'] = traceback.format_exc()
+
+    record['elapsed'] = round(time.time() - start, 3)
+    return record
+
+
+def load_jobs(path):
+    """读取并校验任务文件"""
+    jobs = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault('id', f'job{line_no}')
+            job['id'] = str(job['id'])
+            job.setdefault('stages', list(STAGES) if job.get('input') else ['analyze', 'render'])
+
+            unknown = [s for s in job['stages'] if s not in STAGES]
+            if unknown:
+                raise ValueError(f'第 {line_no} 行：不支持的阶段 {unknown}')
+            try:
+                expand_metrics(job.get('metrics'))
+            except ValueError as e:
+                raise ValueError(f'第 {line_no} 行：{e}')
+            unknown = [r for r in job.get('render', []) if r not in RENDER_TYPES]
+            if unknown:
+                raise ValueError(f'第 {line_no} 行：不支持的可视化类型 {unknown}')
+            if 'build' in job['stages'] and not job.get('input'):
+                raise ValueError(f'第 {line_no} 行：build 阶段需要 input')
+            if 'build' not in job['stages'] and not job.get('graph'):
+                raise ValueError(f'第 {line_no} 行：缺少 input 或 graph')
+            if job['id'] in seen or job['id'] != os.path.basename(job['id']) or job['id'] in ('.', '..', 'assets'):
+                raise ValueError(f'第 {line_no} 行：任务ID无效或重复 {job["id"]}')
+            seen.add(job['id'])
+            jobs.append(job)
+    return jobs
+
+
+def completed_jobs(results_file):
+    """读取已成功完成的任务ID；中断时写了一半的最后一行会被忽略"""
+    done = set()
+    if not os.path.exists(results_file):
+        return done
+    with open(results_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get('status') == 'ok':
+                done.add(record['id'])
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CogniGraph 批处理：构建 → 分析 → 可视化')
+    parser.add_argument('jobs', help='JSONL任务文件')
+    parser.add_argument('--output', default='batch_outputs', help='输出目录')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--threads', type=int, default=1, help='每个工作进程的计算线程数')
+    parser.add_argument('--no-resume', action='store_true', help='不跳过已完成的任务')
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.jobs)
+    os.makedirs(args.output, exist_ok=True)
+    results_file = os.path.join(args.output, 'results.jsonl')
+
+    done = set() if args.no_resume else completed_jobs(results_file)
+    pending = [job for job in jobs if job['id'] not in done]
+    print(f'共 {len(jobs)} 个任务，已完成 {len(jobs) - len(pending)} 个，待执行 {len(pending)} 个')
+    if not pending:
+        return
+
+    # plotly.js 只写一份，各任务的HTML通过相对路径引用
+    from visualizations import ensure_plotly_asset
+    plotly_js_url = '../assets/' + os.path.basename(ensure_plotly_asset(args.output))
+
+    workers = max(1, min(args.workers, len(pending)))
+    # spawn 出的工作进程导入 numpy 时读取这些变量，必须在创建进程池前设置
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(args.threads)
+    context = multiprocessing.get_context('spawn')
+    start = time.time()
+    failed = 0
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(args.output, plotly_js_url, args.threads)) as pool, \
+            open(results_file, 'a', encoding='utf-8') as results:
+        for i, record in enumerate(pool.imap_unordered(run_job, pending), 1):
+            results.write(json.dumps(record, ensure_ascii=False) + '\n')
+            results.flush()
+            if record['status'] != 'ok':
+                failed += 1
+            print(f"[{i}/{len(pending)}] {record['id']}: {record['status']} ({record['elapsed']}s)"
+                  + (f" - {record['error']}" if record['status'] != 'ok' else ''))
+
+    elapsed = time.time() - start
+    print(f'完成 {len(pending) - failed} 个，失败 {failed} 个，用时 {elapsed:.1f}s，'
+          f'吞吐 {len(pending) / elapsed:.2f} 任务/秒')
+
+
+if __name__ == '__main__':
+    main()
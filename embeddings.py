@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+MODEL_PATH = './model'
+
+
+@lru_cache(maxsize=None)
+def get_model(model_path=MODEL_PATH):
+    """加载词向量模型（每个进程只加载一次）"""
+    return SentenceTransformer(model_path)
+
+
+class EmbeddingCache:
+    """实体名称词向量缓存：只对未见过的名称调用模型编码"""
+
+    def __init__(self, model_path=MODEL_PATH, max_entries=200000):
+        self.model_path = model_path
+        self.max_entries = max_entries
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        return get_model(self.model_path)
+
+    def encode(self, names):
+        """
+        获取名称列表的词向量
+
+        Args:
+            names: 名称列表
+
+        Returns:
+            np.ndarray: 形状为 (len(names), dim) 的词向量矩阵
+        """
+        names = list(names)
+        with self._lock:
+            found = {}
+            for name in set(names):
+                if name in self._vectors:
+                    found[name] = self._vectors[name]
+                    self._vectors.move_to_end(name)
+
+        missing = [n for n in dict.fromkeys(names) if n not in found]
+        if missing:
+            vectors = np.asarray(self.model.encode(missing), dtype=np.float32)
+            found.update(zip(missing, vectors))
+            with self._lock:
+                for name, vector in zip(missing, vectors):
+                    self._vectors[name] = vector
+                while len(self._vectors) > self.max_entries:
+                    self._vectors.popitem(last=False)
+
+        if not names:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.vstack([found[n] for n in names])
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """获取进程内共享的词向量缓存"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
@@ -1,31 +1,96 @@
 import networkx as nx
-from collections import Counter
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import threading
 import numpy as np
+from graph_store import compute_graph_id
+
+# 中心性指标：名称 -> (计算函数, 说明)
+CENTRALITY_METRICS = OrderedDict([
+    ('degree_centrality', (nx.degree_centrality, '度中心性：衡量节点的直接连接数量')),
+    ('betweenness_centrality', (nx.betweenness_centrality, '介数中心性：衡量节点在网络中的桥梁作用')),
+    ('closeness_centrality', (nx.closeness_centrality, '接近中心性：衡量节点到其他节点的平均距离')),
+    ('pagerank', (nx.pagerank, 'PageRank：衡量节点的重要性和影响力')),
+])
+
+# 可单独请求的指标
+METRICS = (
+    'basic_stats', 'diameter', *CENTRALITY_METRICS, 'community', 'connectivity', 'type_distribution'
+)
+
+# 计算量大的指标（O(VE)及以上），在独立的进程池中计算，不与快指标排队
+SLOW_METRICS = {'diameter', 'betweenness_centrality', 'closeness_centrality', 'community'}
+
+# 指标组：请求组名等价于请求组内全部指标
+METRIC_GROUPS = {
+    'centrality': list(CENTRALITY_METRICS),
+}
+
+
+def expand_metrics(metrics=None):
+    """展开指标组并去重；未指定时返回全部指标，遇到未知指标抛出ValueError"""
+    if not metrics:
+        return list(METRICS)
+    expanded = []
+    for name in metrics:
+        for metric in METRIC_GROUPS.get(name, [name]):
+            if metric not in METRICS:
+                raise ValueError(f"unknown metric: {metric}")
+            if metric not in expanded:
+                expanded.append(metric)
+    return expanded
+
+
+def assemble_results(results):
+    """将各指标结果组装为 analyze() 的输出结构"""
+    analysis = {}
+    for name, value in results.items():
+        if name in CENTRALITY_METRICS:
+            analysis.setdefault('centrality', {})[name] = value
+        else:
+            analysis[name] = value
+
+    # 兼容旧结构：直径信息同时放在 basic_stats 中
+    if 'basic_stats' in analysis and 'diameter' in analysis:
+        analysis['basic_stats'] = dict(analysis['basic_stats'], **analysis['diameter'])
+    return analysis
+
 
 class GraphAnalytics:
     """图谱分析器"""
 
-    def analyze(self, graph_data):
+    def analyze(self, graph_data, metrics=None):
         """
-        对知识图谱进行全面分析
+        对知识图谱进行分析
 
         Args:
             graph_data: 图谱数据
+            metrics: 需要计算的指标或指标组列表，默认全部
 
         Returns:
             dict: 分析结果
         """
         G = self._build_networkx_graph(graph_data)
+        results = {name: self.compute(name, G, graph_data) for name in expand_metrics(metrics)}
+        return assemble_results(results)
 
-        analysis = {
-            'basic_stats': self._basic_statistics(G, graph_data),
-            'centrality': self._centrality_analysis(G),
-            'community': self._community_detection(G),
-            'connectivity': self._connectivity_analysis(G),
-            'type_distribution': self._type_distribution(graph_data)
-        }
-
-        return analysis
+    def compute(self, name, G, graph_data):
+        """计算单个指标"""
+        if name == 'basic_stats':
+            return self._basic_statistics(G, graph_data)
+        elif name == 'diameter':
+            return self._diameter(G)
+        elif name in CENTRALITY_METRICS:
+            return self._centrality(G, name)
+        elif name == 'community':
+            return self._community_detection(G)
+        elif name == 'connectivity':
+            return self._connectivity_analysis(G)
+        elif name == 'type_distribution':
+            return self._type_distribution(graph_data)
+        raise ValueError(f"unknown metric: {name}")
 
     def _build_networkx_graph(self, graph_data):
         """构建NetworkX图"""
@@ -51,9 +116,6 @@ class GraphAnalytics:
 
     def _basic_statistics(self, G, graph_data):
         """基本统计信息"""
-        # 转换为无向图以计算某些指标
-        G_undirected = G.to_undirected()
-
         stats = {
             'node_count': G.number_of_nodes(),
             'edge_count': G.number_of_edges(),
@@ -63,64 +125,43 @@ class GraphAnalytics:
             'num_components': nx.number_weakly_connected_components(G),
         }
 
-        # 计算直径（仅对连通图）
-        if stats['is_connected']:
+        return stats
+
+    def _diameter(self, G):
+        """图直径和平均最短路径（仅对连通图，计算量较大）"""
+        # 转换为无向图以计算某些指标
+        G_undirected = G.to_undirected()
+
+        if G.number_of_nodes() > 0 and nx.is_weakly_connected(G):
             try:
-                stats['diameter'] = nx.diameter(G_undirected)
-                stats['average_shortest_path'] = nx.average_shortest_path_length(G_undirected)
+                return {
+                    'diameter': nx.diameter(G_undirected),
+                    'average_shortest_path': nx.average_shortest_path_length(G_undirected)
+                }
             except:
-                stats['diameter'] = None
-                stats['average_shortest_path'] = None
-        else:
-            stats['diameter'] = None
-            stats['average_shortest_path'] = None
+                pass
+        return {'diameter': None, 'average_shortest_path': None}
 
-        return stats
-
-    def _centrality_analysis(self, G):
+    def _centrality(self, G, name):
         """中心性分析"""
-        # 度中心性
-        degree_centrality = nx.degree_centrality(G)
-        # 介数中心性
-        betweenness_centrality = nx.betweenness_centrality(G)
-        # 接近中心性
+        func, description = CENTRALITY_METRICS[name]
         try:
-            closeness_centrality = nx.closeness_centrality(G)
+            scores = func(G)
         except:
-            closeness_centrality = {node: 0 for node in G.nodes()}
-
-        # PageRank
-        pagerank = nx.pagerank(G)
+            scores = {node: 0 for node in G.nodes()}
 
         # 获取TOP节点
-        def get_top_nodes(centrality_dict, top_n=5):
-            sorted_nodes = sorted(centrality_dict.items(), key=lambda x: x[1], reverse=True)
-            return [
+        sorted_nodes = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return {
+            'top_nodes': [
                 {
                     'id': node_id,
                     'name': G.nodes[node_id]['name'],
                     'score': round(score, 4)
                 }
-                for node_id, score in sorted_nodes[:top_n]
-            ]
-
-        return {
-            'degree_centrality': {
-                'top_nodes': get_top_nodes(degree_centrality),
-                'description': '度中心性：衡量节点的直接连接数量'
-            },
-            'betweenness_centrality': {
-                'top_nodes': get_top_nodes(betweenness_centrality),
-                'description': '介数中心性：衡量节点在网络中的桥梁作用'
-            },
-            'closeness_centrality': {
-                'top_nodes': get_top_nodes(closeness_centrality),
-                'description': '接近中心性：衡量节点到其他节点的平均距离'
-            },
-            'pagerank': {
-                'top_nodes': get_top_nodes(pagerank),
-                'description': 'PageRank：衡量节点的重要性和影响力'
-            }
+                for node_id, score in sorted_nodes[:5]
+            ],
+            'description': description
         }
 
     def _community_detection(self, G):
@@ -161,6 +202,62 @@ class GraphAnalytics:
                 'description': f'社区检测失败: {str(e)}'
             }
 
+    def community_aggregates(self, graph_data):
+        """
+        预计算社区聚合数据，用于分层（LOD）可视化
+
+        Args:
+            graph_data: 图谱数据
+
+        Returns:
+            dict: 社区列表、节点归属和社区间边束
+        """
+        G = self._build_networkx_graph(graph_data)
+        G_undirected = G.to_undirected()
+
+        from networkx.algorithms import community
+        # 大图上 Louvain 比贪心模块度快得多；固定随机种子保证结果稳定
+        communities = community.louvain_communities(G_undirected, weight='weight', seed=42)
+        communities = sorted(communities, key=len, reverse=True)
+
+        membership = {}
+        community_list = []
+        for i, comm in enumerate(communities):
+            community_id = i + 1
+            for node_id in comm:
+                membership[str(node_id)] = community_id
+
+            top_nodes = sorted(comm, key=lambda n: G.degree(n), reverse=True)[:5]
+            type_counts = Counter(G.nodes[n]['type'] for n in comm)
+            community_list.append({
+                'community_id': community_id,
+                'size': len(comm),
+                'label': G.nodes[top_nodes[0]]['name'],
+                'top_nodes': [G.nodes[n]['name'] for n in top_nodes],
+                'types': dict(type_counts.most_common()),
+                'internal_edges': 0
+            })
+
+        # 社区间边束：按无序社区对汇总边数与权重
+        bundles = {}
+        for source, target, attrs in G.edges(data=True):
+            c1 = membership[str(source)]
+            c2 = membership[str(target)]
+            if c1 == c2:
+                community_list[c1 - 1]['internal_edges'] += 1
+                continue
+            key = (min(c1, c2), max(c1, c2))
+            bundle = bundles.setdefault(key, {'source': key[0], 'target': key[1], 'count': 0, 'weight': 0})
+            bundle['count'] += 1
+            bundle['weight'] += attrs.get('weight', 5)
+
+        return {
+            'num_communities': len(community_list),
+            'communities': community_list,
+            'membership': membership,
+            'bundles': sorted(bundles.values(), key=lambda b: b['count'], reverse=True)
+        }
+
     def _connectivity_analysis(self, G):
         """连通性分析"""
         components = list(nx.weakly_connected_components(G))
@@ -207,3 +304,182 @@ class GraphAnalytics:
             'total_node_types': len(type_counts),
             'total_relation_types': len(relation_counts)
         }
+
+
+def _compute_metric(graph_data, name):
+    """
+    在工作进程中计算单个指标（模块级函数，便于进程池序列化）
+
+    Returns:
+        tuple: (结果, 错误信息)。指标代码自身抛出的异常在这里转为错误信息，
+               与进程崩溃、任务取消等执行环境的异常区分开
+    """
+    try:
+        analyzer = GraphAnalytics()
+        G = analyzer._build_networkx_graph(graph_data)
+        return analyzer.compute(name, G, graph_data), None
+    except Exception as e:
+        return None, str(e)
+
+
+class AnalyticsService:
+    """
+    按需、带缓存、限时的图谱分析
+
+    每个指标的结果按图谱内容哈希缓存。快指标在线程池中计算，慢指标在独立的
+    进程池中并行计算，因此慢指标不会阻塞快指标。超出时间预算仍未完成的指标
+    标记为 pending，计算完成后写入缓存，可稍后再取。
+
+    工作进程意外退出（如内存不足被杀）会使整个进程池失效，此时重建进程池并
+    重新提交受影响的指标（每个指标最多重试 SLOW_RETRIES 次）；只有指标代码
+    自身抛出的异常才作为错误缓存。
+    """
+
+    SLOW_RETRIES = 1
+
+    def __init__(self, max_workers=None, max_graphs=32):
+        self.max_graphs = max_graphs
+        self._slow_workers = max_workers or min(4, multiprocessing.cpu_count())
+        self._fast_executor = ThreadPoolExecutor(max_workers=4)
+        self._slow_executor = self._create_slow_executor()
+        # graph_id -> {metric: result}
+        self._results = OrderedDict()
+        # graph_id -> {metric: 错误信息}，计算失败的指标同样按内容哈希缓存
+        self._errors = {}
+        # (graph_id, metric) -> Future
+        self._running = {}
+        # 已完成的Future会在 add_done_callback 中同步回调，需要可重入锁
+        self._lock = threading.RLock()
+
+    def request(self, graph_data, metrics=None, budget=None):
+        """
+        请求若干指标
+
+        Args:
+            graph_data: 图谱数据
+            metrics: 指标或指标组列表，默认全部
+            budget: 最长等待秒数，None 表示等待全部完成
+
+        Returns:
+            dict: {'graph_id', 'results', 'pending', 'missing', 'errors'}
+        """
+        names = expand_metrics(metrics)
+        graph_id = compute_graph_id(graph_data)
+
+        futures = []
+        with self._lock:
+            cached = self._results.get(graph_id, {})
+            failed = self._errors.get(graph_id, {})
+            for name in names:
+                if name in cached or name in failed or (graph_id, name) in self._running:
+                    continue
+                self._submit(graph_data, graph_id, name, self.SLOW_RETRIES)
+            futures = [self._running[(graph_id, n)] for n in names if (graph_id, n) in self._running]
+
+        if futures:
+            wait(futures, timeout=budget)
+        return self.get(graph_id, names)
+
+    def get(self, graph_id, metrics=None):
+        """
+        获取已缓存的指标结果
+
+        Returns:
+            dict: {'graph_id', 'results', 'pending', 'missing', 'errors'}，
+                  missing 为既未缓存也未在计算的指标
+        """
+        names = expand_metrics(metrics)
+        results, pending, missing, errors = {}, [], [], {}
+        with self._lock:
+            cached = self._results.get(graph_id, {})
+            failed = self._errors.get(graph_id, {})
+            if graph_id in self._results:
+                self._results.move_to_end(graph_id)
+            for name in names:
+                if name in cached:
+                    results[name] = cached[name]
+                elif name in failed:
+                    errors[name] = failed[name]
+                elif (graph_id, name) in self._running:
+                    pending.append(name)
+                else:
+                    missing.append(name)
+        return {
+            'graph_id': graph_id,
+            'results': results,
+            'pending': pending,
+            'missing': missing,
+            'errors': errors
+        }
+
+    def _create_slow_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self._slow_workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def _submit(self, graph_data, graph_id, name, retries):
+        """提交单个指标的计算，调用方需持有 self._lock"""
+        if name in SLOW_METRICS:
+            executor = self._slow_executor
+            try:
+                future = executor.submit(_compute_metric, graph_data, name)
+            except BrokenProcessPool:
+                executor = self._replace_slow_executor(executor)
+                future = executor.submit(_compute_metric, graph_data, name)
+        else:
+            executor = self._fast_executor
+            future = executor.submit(_compute_metric, graph_data, name)
+
+        key = (graph_id, name)
+        self._running[key] = future
+        future.add_done_callback(
+            lambda f: self._on_done(key, f, executor, graph_data, retries)
+        )
+
+    def _replace_slow_executor(self, broken):
+        """
+        用新的进程池替换已失效的进程池，调用方需持有 self._lock
+
+        失效的进程池会自行终止剩余的工作进程，这里只替换引用；同一进程池上
+        多个任务的失败回调只触发一次重建。
+        """
+        if self._slow_executor is broken:
+            self._slow_executor = self._create_slow_executor()
+        return self._slow_executor
+
+    def _on_done(self, key, future, executor, graph_data, retries):
+        graph_id, name = key
+
+        with self._lock:
+            if self._running.get(key) is future:
+                self._running.pop(key)
+
+            if future.cancelled():
+                return
+            try:
+                value, error = future.result()
+            except BrokenProcessPool:
+                # 工作进程意外退出：重建进程池后重试，不作为指标错误缓存
+                self._replace_slow_executor(executor)
+                if retries > 0 and key not in self._running:
+                    self._submit(graph_data, graph_id, name, retries - 1)
+                return
+            except Exception:
+                # 执行环境的其他异常（如结果无法序列化）同样不缓存，下次请求时重新计算
+                return
+
+            if error is not None:
+                self._errors.setdefault(graph_id, {})[name] = error
+            else:
+                self._results.setdefault(graph_id, {})[name] = value
+            if graph_id not in self._results:
+                self._results[graph_id] = {}
+            self._results.move_to_end(graph_id)
+            while len(self._results) > self.max_graphs:
+                evicted, _ = self._results.popitem(last=False)
+                self._errors.pop(evicted, None)
+
+    def shutdown(self):
+        self._fast_executor.shutdown(wait=False, cancel_futures=True)
+        self._slow_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,330 @@
+import heapq
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+
+
+def normalize_name(name):
+    """名称归一化：全角转半角（NFKC）并忽略大小写"""
+    return unicodedata.normalize('NFKC', str(name)).casefold().strip()
+
+
+class GraphIndex:
+    """图谱查询索引：名称检索、k跳邻域、加权最短路径"""
+
+    def __init__(self, graph_data):
+        self.nodes = {}
+        self.degree = defaultdict(int)
+        # 邻接表：node_id -> [(neighbor_id, edge_index)]
+        self.out_adj = defaultdict(list)
+        self.in_adj = defaultdict(list)
+        self.edges = []
+
+        for node in graph_data.get('nodes', []):
+            self.nodes[node['id']] = node
+
+        for edge in graph_data.get('edges', []):
+            source, target = edge['source'], edge['target']
+            if source not in self.nodes or target not in self.nodes:
+                continue
+            edge_index = len(self.edges)
+            self.edges.append(edge)
+            self.out_adj[source].append((target, edge_index))
+            self.in_adj[target].append((source, edge_index))
+            self.degree[source] += 1
+            self.degree[target] += 1
+
+        self._build_name_index()
+
+    def _build_name_index(self):
+        """构建名称索引：有序名称表用于前缀查询，字符n-gram倒排表用于子串查询"""
+        self.norm_names = {}
+        self.sorted_names = []
+        # 单字与双字倒排表；中文按字切分，天然适配无空格文本
+        self.unigrams = defaultdict(set)
+        self.bigrams = defaultdict(set)
+
+        for node_id, node in self.nodes.items():
+            norm = normalize_name(node.get('name', ''))
+            self.norm_names[node_id] = norm
+            self.sorted_names.append((norm, str(node_id), node_id))
+            for i, ch in enumerate(norm):
+                self.unigrams[ch].add(node_id)
+                if i + 1 < len(norm):
+                    self.bigrams[norm[i:i + 2]].add(node_id)
+
+        self.sorted_names.sort()
+        self._sorted_keys = [item[0] for item in self.sorted_names]
+
+    # ------------------------------------------------------------------
+    # 名称检索
+    # ------------------------------------------------------------------
+
+    def search(self, query, mode='substring', types=None, offset=0, limit=20):
+        """
+        按名称检索实体
+
+        Args:
+            query: 查询字符串
+            mode: 'prefix' 前缀匹配 / 'substring' 子串匹配
+            types: 实体类型过滤列表（可选）
+            offset: 分页偏移
+            limit: 每页数量
+
+        Returns:
+            dict: {'total', 'offset', 'next_offset', 'results'}
+        """
+        q = normalize_name(query)
+        if not q:
+            return self._page([], offset, limit)
+
+        if mode == 'prefix':
+            start = bisect_left(self._sorted_keys, q)
+            end = bisect_right(self._sorted_keys, q + '\U0010ffff', lo=start)
+            candidates = [item[2] for item in self.sorted_names[start:end]]
+        elif mode == 'substring':
+            candidates = self._substring_candidates(q)
+        else:
+            raise ValueError("mode must be 'prefix' or 'substring'")
+
+        if types:
+            types = set(types)
+            candidates = [n for n in candidates if self.nodes[n].get('type') in types]
+
+        # 排序：完全匹配 > 前缀匹配 > 其他；同级按度数降序、名称长度升序
+        def rank(node_id):
+            norm = self.norm_names[node_id]
+            return (
+                norm != q,
+                not norm.startswith(q),
+                -self.degree[node_id],
+                len(norm),
+                norm
+            )
+
+        page = self._page(candidates, offset, limit)
+        # 只对当前页之前的结果做部分排序，避免短查询时对全部候选排序
+        top = heapq.nsmallest(page['offset'] + len(page['results']), candidates, key=rank)
+        page['results'] = [self._node_summary(n) for n in top[page['offset']:]]
+        return page
+
+    def _substring_candidates(self, q):
+        if len(q) == 1:
+            return list(self.unigrams.get(q, ()))
+
+        grams = [q[i:i + 2] for i in range(len(q) - 1)]
+        postings = [self.bigrams.get(g) for g in grams]
+        if any(p is None for p in postings):
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates &= p
+            if not candidates:
+                return []
+        # n-gram交集可能有假阳性，需二次校验
+        return [n for n in candidates if q in self.norm_names[n]]
+
+    # ------------------------------------------------------------------
+    # k跳邻域
+    # ------------------------------------------------------------------
+
+    def neighborhood(self, node_id, k=1, types=None, relations=None,
+                     direction='both', offset=0, limit=200):
+        """
+        提取以 node_id 为中心的k跳邻域子图
+
+        节点按BFS顺序分页；每条边只在其两个端点都已出现的那一页返回，
+        客户端累积所有分页即可得到完整子图。
+
+        Args:
+            node_id: 中心实体ID
+            k: 跳数
+            types: 实体类型过滤（中心节点不受限制）
+            relations: 关系过滤
+            direction: 'out' / 'in' / 'both'
+            offset: 分页偏移
+            limit: 每页节点数
+
+        Returns:
+            dict: {'total', 'offset', 'next_offset', 'nodes', 'edges'}，中心节点不存在时返回None
+        """
+        if node_id not in self.nodes:
+            return None
+
+        types = set(types) if types else None
+        relations = set(relations) if relations else None
+
+        order = {node_id: 0}
+        hops = {node_id: 0}
+        queue = deque([node_id])
+        while queue:
+            current = queue.popleft()
+            if hops[current] >= k:
+                continue
+            for neighbor, edge_index in self._neighbors(current, direction):
+                if neighbor in order:
+                    continue
+                if relations and self.edges[edge_index].get('relation') not in relations:
+                    continue
+                if types and self.nodes[neighbor].get('type') not in types:
+                    continue
+                order[neighbor] = len(order)
+                hops[neighbor] = hops[current] + 1
+                queue.append(neighbor)
+
+        ordered = list(order)
+        page = self._page(ordered, offset, limit)
+
+        # 每条边由BFS顺序较大的端点负责返回，保证跨页不重复
+        edges = []
+        for node in page['results']:
+            position = order[node]
+            candidates = [(n, i, True) for n, i in self.out_adj.get(node, ())]
+            candidates += [(n, i, False) for n, i in self.in_adj.get(node, ())]
+            for neighbor, edge_index, outgoing in candidates:
+                other = order.get(neighbor)
+                if other is None or other > position:
+                    continue
+                # 自环在出边、入边中各出现一次，只取出边
+                if other == position and not outgoing:
+                    continue
+                edge = self.edges[edge_index]
+                if relations and edge.get('relation') not in relations:
+                    continue
+                edges.append(edge)
+
+        return {
+            'total': page['total'],
+            'offset': page['offset'],
+            'next_offset': page['next_offset'],
+            'nodes': [dict(self.nodes[n], hop=hops[n]) for n in page['results']],
+            'edges': edges
+        }
+
+    def _neighbors(self, node_id, direction):
+        if direction in ('out', 'both'):
+            yield from self.out_adj.get(node_id, ())
+        if direction in ('in', 'both'):
+            yield from self.in_adj.get(node_id, ())
+
+    # ------------------------------------------------------------------
+    # 最短路径
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def edge_cost(edge):
+        """边代价：关系强度越大，距离越短"""
+        weight = edge.get('weight', 5)
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            weight = 5.0
+        return 1.0 / max(weight, 0.1)
+
+    def shortest_path(self, source, target, directed=False, relations=None):
+        """
+        双向Dijkstra加权最短路径
+
+        Args:
+            source: 起点实体ID
+            target: 终点实体ID
+            directed: 是否遵循关系方向
+            relations: 关系过滤（可选）
+
+        Returns:
+            dict: {'cost', 'nodes', 'edges'}，不可达时返回None
+        """
+        if source not in self.nodes or target not in self.nodes:
+            return None
+        if source == target:
+            return {'cost': 0.0, 'nodes': [self.nodes[source]], 'edges': []}
+
+        relations = set(relations) if relations else None
+        forward_dir = 'out' if directed else 'both'
+        backward_dir = 'in' if directed else 'both'
+
+        dist = [{source: 0.0}, {target: 0.0}]
+        parent = [{source: None}, {target: None}]
+        settled = [set(), set()]
+        heaps = [[(0.0, 0, source)], [(0.0, 0, target)]]
+        directions = [forward_dir, backward_dir]
+        counter = 1
+        best = float('inf')
+        meeting = None
+
+        while heaps[0] and heaps[1]:
+            # 两侧堆顶之和不小于当前最优值时可终止
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            d, _, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+
+            for neighbor, edge_index in self._neighbors(node, directions[side]):
+                edge = self.edges[edge_index]
+                if relations and edge.get('relation') not in relations:
+                    continue
+                nd = d + self.edge_cost(edge)
+                if nd < dist[side].get(neighbor, float('inf')):
+                    dist[side][neighbor] = nd
+                    parent[side][neighbor] = (node, edge_index)
+                    heapq.heappush(heaps[side], (nd, counter, neighbor))
+                    counter += 1
+                other = dist[1 - side].get(neighbor)
+                if other is not None and nd + other < best:
+                    best = nd + other
+                    meeting = neighbor
+
+        if meeting is None:
+            return None
+
+        path_nodes = [meeting]
+        path_edges = []
+        node = meeting
+        while parent[0][node] is not None:
+            node, edge_index = parent[0][node]
+            path_nodes.append(node)
+            path_edges.append(self.edges[edge_index])
+        path_nodes.reverse()
+        path_edges.reverse()
+
+        node = meeting
+        while parent[1][node] is not None:
+            node, edge_index = parent[1][node]
+            path_nodes.append(node)
+            path_edges.append(self.edges[edge_index])
+
+        return {
+            'cost': round(best, 6),
+            'nodes': [self.nodes[n] for n in path_nodes],
+            'edges': path_edges
+        }
+
+    # ------------------------------------------------------------------
+    # 工具函数
+    # ------------------------------------------------------------------
+
+    def _node_summary(self, node_id):
+        node = self.nodes[node_id]
+        return {
+            'id': node_id,
+            'name': node.get('name', ''),
+            'type': node.get('type', ''),
+            'degree': self.degree[node_id]
+        }
+
+    @staticmethod
+    def _page(items, offset, limit):
+        total = len(items)
+        offset = max(0, int(offset))
+        limit = max(1, int(limit))
+        end = offset + limit
+        return {
+            'total': total,
+            'offset': offset,
+            'next_offset': end if end < total else None,
+            'results': items[offset:end]
+        }
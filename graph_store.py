@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+
+def compute_graph_id(graph_data):
+    """根据图谱内容计算稳定的图谱ID（内容哈希）"""
+    payload = json.dumps(
+        {'nodes': graph_data.get('nodes', []), 'edges': graph_data.get('edges', [])},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def is_valid_graph_id(graph_id):
+    """校验图谱ID格式，防止路径穿越"""
+    return isinstance(graph_id, str) and re.fullmatch(r'[0-9a-f]{16}', graph_id) is not None
+
+
+def _write_json_atomic(path, data):
+    """先写临时文件再替换，避免并发读到半写入的文件"""
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class GraphStore:
+    """图谱存储：按内容哈希保存图谱，并缓存每个图谱的派生数据（索引等）"""
+
+    def __init__(self, output_dir='outputs', max_cached_graphs=8):
+        self.graph_dir = os.path.join(output_dir, 'graphs')
+        os.makedirs(self.graph_dir, exist_ok=True)
+        self.max_cached_graphs = max_cached_graphs
+        # graph_id -> {'graph_data': ..., 'artifacts': {name: value}}
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _graph_path(self, graph_id):
+        return os.path.join(self.graph_dir, f'{graph_id}.json')
+
+    def save(self, graph_data):
+        """
+        保存图谱数据
+
+        Args:
+            graph_data: 图谱数据
+
+        Returns:
+            str: 图谱ID
+        """
+        graph_id = compute_graph_id(graph_data)
+        path = self._graph_path(graph_id)
+        if not os.path.exists(path):
+            _write_json_atomic(path, graph_data)
+        with self._lock:
+            self._entry(graph_id, graph_data)
+        return graph_id
+
+    def exists(self, graph_id):
+        return is_valid_graph_id(graph_id) and os.path.exists(self._graph_path(graph_id))
+
+    def load(self, graph_id):
+        """读取图谱数据，不存在时返回None"""
+        if not is_valid_graph_id(graph_id):
+            return None
+        with self._lock:
+            if graph_id in self._cache:
+                self._cache.move_to_end(graph_id)
+                return self._cache[graph_id]['graph_data']
+
+        path = self._graph_path(graph_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            graph_data = json.load(f)
+
+        with self._lock:
+            return self._entry(graph_id, graph_data)['graph_data']
+
+    def get_artifact(self, graph_id, name, factory, persist=False):
+        """
+        获取图谱的派生数据，不存在时调用 factory(graph_data) 构建并缓存
+
+        Args:
+            graph_id: 图谱ID
+            name: 派生数据名称（如 'index'）
+            factory: 构建函数，参数为图谱数据
+            persist: 是否同时以JSON形式保存到磁盘（仅适用于可序列化的结果）
+
+        Returns:
+            派生数据，图谱不存在时返回None
+        """
+        graph_data = self.load(graph_id)
+        if graph_data is None:
+            return None
+
+        with self._lock:
+            entry = self._entry(graph_id, graph_data)
+            if name in entry['artifacts']:
+                return entry['artifacts'][name]
+
+        artifact_path = os.path.join(self.graph_dir, f'{graph_id}.{name}.json')
+        if persist and os.path.exists(artifact_path):
+            with open(artifact_path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        else:
+            # 构建过程可能较慢，不持有锁
+            value = factory(graph_data)
+            if persist:
+                _write_json_atomic(artifact_path, value)
+
+        with self._lock:
+            entry = self._entry(graph_id, graph_data)
+            return entry['artifacts'].setdefault(name, value)
+
+    def _entry(self, graph_id, graph_data):
+        """取得（或创建）缓存条目，并按LRU淘汰旧图谱（调用方需持有锁）"""
+        entry = self._cache.get(graph_id)
+        if entry is None:
+            entry = {'graph_data': graph_data, 'artifacts': {}}
+            self._cache[graph_id] = entry
+        self._cache.move_to_end(graph_id)
+        while len(self._cache) > self.max_cached_graphs:
+            self._cache.popitem(last=False)
+        return entry
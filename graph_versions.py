@@ -0,0 +1,446 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from werkzeug.utils import secure_filename
+
+# 每隔多少个版本保存一次完整快照，读取历史版本时最多回放这么多个增量
+SNAPSHOT_INTERVAL = 10
+
+# 图谱中除节点和边以外的元数据字段
+META_FIELDS = ('theme', 'title', 'abstract', 'aspects', 'reader', 'purpose', 'purposes', 'source')
+
+# 来源信息字段：只有这些字段变化时不算作实体或关系的修改（增量中仍然保存）
+PROVENANCE_FIELDS = ('paragraphs',)
+
+# 单个段落的最大字符数，超过时按句子切分，保证修改一句话只需重新抽取一小段
+PARAGRAPH_CHAR_LIMIT = 800
+
+# 段首缩进（全角空格、两个以上空格或制表符）
+_INDENT = re.compile(r'(?:\u3000|[ \t]{2,}|\t)')
+# 句末标点
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;…])')
+
+
+def document_key(name):
+    """
+    文档的稳定标识（可直接用作文件名）
+
+    secure_filename 会去掉中文字符（'射雕英雄传.txt' -> 'txt'），不同文档会得到相同的名称，
+    因此名称有字符被去掉时，在结果中加入原始名称的哈希。
+    """
+    key = secure_filename(name)
+    if key == name:
+        return key
+    root, ext = os.path.splitext(name)
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:12]
+    ext = ext.lower() if re.fullmatch(r'\.[A-Za-z0-9]+', ext) else ''
+    return f"{secure_filename(root) or 'doc'}_{digest}{ext}"
+
+
+def split_paragraphs(text, max_chars=PARAGRAPH_CHAR_LIMIT):
+    """
+    将文本切分为段落
+
+    空行总是分段；文本中有段首缩进时，以缩进开头的行开始新段落，其余行视为
+    上一段的折行；既没有缩进也没有空行时按行分段（中文文本通常一行一段）。
+    超过 max_chars 的段落再按句子切分。
+    """
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    lines = lines[content[0]:content[-1] + 1] if content else []
+    indented = any(_INDENT.match(line) and line.strip() for line in lines)
+    one_per_line = not indented and all(line.strip() for line in lines)
+
+    blocks, current = [], []
+    for line in lines:
+        starts_paragraph = not line.strip() or one_per_line or (indented and _INDENT.match(line))
+        if starts_paragraph and current:
+            blocks.append('\n'.join(current))
+            current = []
+        if line.strip():
+            current.append(line.strip())
+    if current:
+        blocks.append('\n'.join(current))
+
+    paragraphs = []
+    for block in blocks:
+        paragraphs.extend(_split_long(block, max_chars))
+    return paragraphs
+
+
+def _split_long(paragraph, max_chars):
+    """按句子把过长的段落切成不超过 max_chars 的若干段"""
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+
+    chunks, current = [], ''
+    for sentence in _SENTENCE_END.split(paragraph):
+        # 单个句子过长时直接截断
+        while len(sentence) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ''
+        current += sentence
+    if current.strip():
+        chunks.append(current)
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def paragraph_fingerprint(paragraph):
+    """段落指纹：忽略空白差异的内容哈希"""
+    normalized = re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', paragraph)).strip()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def entity_id(name):
+    """由实体名称生成稳定ID，同名实体在各段落、各版本中ID一致"""
+    normalized = unicodedata.normalize('NFKC', str(name)).casefold().strip()
+    return 'e' + hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:10]
+
+
+def edge_key(edge):
+    return f"{edge['source']}|{edge['relation']}|{edge['target']}"
+
+
+def empty_graph():
+    return {'nodes': [], 'edges': []}
+
+
+def patch_graph(graph_data, removed, added, extractions):
+    """
+    把段落的增删应用到图谱上
+
+    每个节点和边的 paragraphs 字段记录其来源段落指纹，第一个来源段落决定其属性。
+    删除段落时去掉对应来源，来源为空的节点和边随之删除；新增段落的抽取结果
+    合并进图谱。未变化段落的抽取结果保持不动，无需重新调用LLM。
+
+    Args:
+        graph_data: 当前图谱
+        removed: 被删除的段落指纹集合
+        added: 新增段落指纹列表（按文档顺序）
+        extractions: 段落指纹 -> 抽取结果 {'nodes': [...], 'edges': [...]}
+
+    Returns:
+        dict: 新图谱
+    """
+    removed = set(removed)
+    nodes = {n['id']: dict(n) for n in graph_data.get('nodes', [])}
+    edges = {edge_key(e): dict(e) for e in graph_data.get('edges', [])}
+
+    def contributed_node(fp, node_id):
+        for node in extractions[fp]['nodes']:
+            if entity_id(node['name']) == node_id:
+                return node
+        return None
+
+    def contributed_edge(fp, key):
+        for edge in extractions[fp]['edges']:
+            if edge_key(_resolve_edge(edge)) == key:
+                return edge
+        return None
+
+    if removed:
+        for node_id in list(nodes):
+            node = nodes[node_id]
+            if not removed.intersection(node['paragraphs']):
+                continue
+            remaining = [p for p in node['paragraphs'] if p not in removed]
+            if not remaining:
+                del nodes[node_id]
+                continue
+            if remaining[0] != node['paragraphs'][0]:
+                source = contributed_node(remaining[0], node_id)
+                if source:
+                    node.update(type=source['type'], description=source.get('description', ''))
+            node['paragraphs'] = remaining
+
+        for key in list(edges):
+            edge = edges[key]
+            if not removed.intersection(edge['paragraphs']):
+                continue
+            remaining = [p for p in edge['paragraphs'] if p not in removed]
+            if not remaining:
+                del edges[key]
+                continue
+            if remaining[0] != edge['paragraphs'][0]:
+                source = contributed_edge(remaining[0], key)
+                if source:
+                    edge['weight'] = source.get('weight', 5)
+            edge['paragraphs'] = remaining
+
+    for fp in added:
+        contribution = extractions[fp]
+        for item in contribution['nodes']:
+            node_id = entity_id(item['name'])
+            node = nodes.get(node_id)
+            if node is None:
+                nodes[node_id] = {
+                    'id': node_id,
+                    'name': item['name'],
+                    'type': item['type'],
+                    'description': item.get('description', ''),
+                    'paragraphs': [fp]
+                }
+            elif fp not in node['paragraphs']:
+                node['paragraphs'].append(fp)
+
+        for item in contribution['edges']:
+            resolved = _resolve_edge(item)
+            key = edge_key(resolved)
+            edge = edges.get(key)
+            if edge is None:
+                edges[key] = dict(resolved, paragraphs=[fp])
+            elif fp not in edge['paragraphs']:
+                edge['paragraphs'].append(fp)
+
+    patched = {k: v for k, v in graph_data.items() if k not in ('nodes', 'edges')}
+    patched['nodes'] = list(nodes.values())
+    patched['edges'] = list(edges.values())
+    return patched
+
+
+def _resolve_edge(item):
+    """将抽取结果中以实体名称表示的边转换为以实体ID表示"""
+    return {
+        'source': entity_id(item['source']),
+        'target': entity_id(item['target']),
+        'relation': item['relation'],
+        'weight': item.get('weight', 5)
+    }
+
+
+def _differs(before, after, ignore_fields=()):
+    keys = (set(before) | set(after)) - set(ignore_fields)
+    return any(before.get(k) != after.get(k) for k in keys)
+
+
+def count_changes(diff, ignore_fields=PROVENANCE_FIELDS):
+    """
+    统计 diff_graphs 结果中节点和边的新增、删除、修改数
+
+    Args:
+        diff: diff_graphs 的结果（或保存的增量）
+        ignore_fields: 只有这些字段变化的修改不计入
+
+    Returns:
+        dict: {'nodes': {'added', 'removed', 'changed'}, 'edges': {...}}
+    """
+    return {
+        kind: {
+            'added': len(diff[kind]['added']),
+            'removed': len(diff[kind]['removed']),
+            'changed': sum(
+                1 for change in diff[kind]['changed']
+                if _differs(change['before'], change['after'], ignore_fields)
+            )
+        }
+        for kind in ('nodes', 'edges')
+    }
+
+
+def diff_graphs(old, new, ignore_fields=()):
+    """
+    比较两个图谱版本
+
+    Args:
+        old: 旧图谱
+        new: 新图谱
+        ignore_fields: 判断"修改"时忽略的字段（如来源段落 'paragraphs'）
+
+    Returns:
+        dict: 节点和边各自的 added / removed / changed 列表，以及元数据变化
+    """
+    def compare(old_items, new_items):
+        added = [item for key, item in new_items.items() if key not in old_items]
+        removed = [item for key, item in old_items.items() if key not in new_items]
+        changed = [
+            {'before': old_items[key], 'after': item}
+            for key, item in new_items.items()
+            if key in old_items and _differs(old_items[key], item, ignore_fields)
+        ]
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    return {
+        'nodes': compare(
+            {n['id']: n for n in old.get('nodes', [])},
+            {n['id']: n for n in new.get('nodes', [])}
+        ),
+        'edges': compare(
+            {edge_key(e): e for e in old.get('edges', [])},
+            {edge_key(e): e for e in new.get('edges', [])}
+        ),
+        'meta': {
+            field: new.get(field)
+            for field in META_FIELDS
+            if old.get(field) != new.get(field) and field in new
+        }
+    }
+
+
+def apply_delta(graph_data, delta):
+    """将 diff_graphs 生成的增量应用到图谱上"""
+    nodes = {n['id']: n for n in graph_data.get('nodes', [])}
+    for node in delta['nodes']['removed']:
+        nodes.pop(node['id'], None)
+    for change in delta['nodes']['changed']:
+        nodes[change['after']['id']] = change['after']
+    for node in delta['nodes']['added']:
+        nodes[node['id']] = node
+
+    edges = {edge_key(e): e for e in graph_data.get('edges', [])}
+    for edge in delta['edges']['removed']:
+        edges.pop(edge_key(edge), None)
+    for change in delta['edges']['changed']:
+        edges[edge_key(change['after'])] = change['after']
+    for edge in delta['edges']['added']:
+        edges[edge_key(edge)] = edge
+
+    result = {k: v for k, v in graph_data.items() if k not in ('nodes', 'edges')}
+    result.update(delta.get('meta', {}))
+    result['nodes'] = list(nodes.values())
+    result['edges'] = list(edges.values())
+    return result
+
+
+class VersionedGraphStore:
+    """
+    按文档保存图谱版本
+
+    目录结构（outputs/documents/<文档>/）：
+        head.json         当前版本的完整图谱和段落指纹列表
+        extractions.json  段落指纹 -> 抽取结果，段落未变化时直接复用
+        versions/v<N>.json           相对上一版本的增量
+        versions/v<N>.snapshot.json  定期保存的完整快照
+    """
+
+    def __init__(self, output_dir='outputs'):
+        self.base_dir = os.path.join(output_dir, 'documents')
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._locks = {}
+        self._async_locks = {}
+        self._locks_guard = threading.Lock()
+
+    def lock(self, document):
+        """获取文档级锁，同一文档的构建串行执行"""
+        with self._locks_guard:
+            return self._locks.setdefault(document_key(document), threading.Lock())
+
+    def async_lock(self, document):
+        """异步构建使用的文档级锁（asyncio.Lock），等待期间不阻塞事件循环"""
+        with self._locks_guard:
+            return self._async_locks.setdefault(document_key(document), asyncio.Lock())
+
+    def _doc_dir(self, document):
+        return os.path.join(self.base_dir, document_key(document))
+
+    def _read(self, path, default=None):
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def head(self, document):
+        """当前版本：{'version', 'paragraphs', 'graph'}，文档尚未构建时返回None"""
+        return self._read(os.path.join(self._doc_dir(document), 'head.json'))
+
+    def get_extractions(self, document):
+        return self._read(os.path.join(self._doc_dir(document), 'extractions.json'), {})
+
+    def save_extractions(self, document, extractions):
+        self._write(os.path.join(self._doc_dir(document), 'extractions.json'), extractions)
+
+    def commit(self, document, graph_data, paragraphs, stats=None):
+        """
+        保存新版本（存储为相对上一版本的增量）
+
+        Returns:
+            int: 新版本号；图谱与段落均无变化时返回当前版本号
+        """
+        doc_dir = self._doc_dir(document)
+        head = self.head(document)
+        previous = head['graph'] if head else empty_graph()
+        version = head['version'] + 1 if head else 1
+
+        delta = diff_graphs(previous, graph_data)
+        if head and head['paragraphs'] == paragraphs and not _delta_size(delta) and not delta['meta']:
+            return head['version']
+
+        self._write(os.path.join(doc_dir, 'versions', f'v{version}.json'), {
+            'version': version,
+            'parent': version - 1,
+            'created_at': time.time(),
+            'paragraphs': paragraphs,
+            'stats': stats or {},
+            'delta': delta
+        })
+        if version % SNAPSHOT_INTERVAL == 0:
+            self._write(os.path.join(doc_dir, 'versions', f'v{version}.snapshot.json'), graph_data)
+        self._write(os.path.join(doc_dir, 'head.json'), {
+            'version': version,
+            'paragraphs': paragraphs,
+            'graph': graph_data
+        })
+        return version
+
+    def list_versions(self, document):
+        """列出所有版本的摘要信息"""
+        head = self.head(document)
+        if not head:
+            return []
+        versions = []
+        for version in range(1, head['version'] + 1):
+            record = self._read(os.path.join(self._doc_dir(document), 'versions', f'v{version}.json'))
+            if record is None:
+                continue
+            versions.append({
+                'version': version,
+                'created_at': record['created_at'],
+                'num_paragraphs': len(record['paragraphs']),
+                'stats': record.get('stats', {}),
+                # 与 /api/graph/diff 一致：来源段落的变化不算作修改
+                'changes': count_changes(record['delta'])
+            })
+        return versions
+
+    def load_version(self, document, version):
+        """从最近的快照开始回放增量，重建指定版本的图谱；版本不存在时返回None"""
+        head = self.head(document)
+        if not head or not 1 <= version <= head['version']:
+            return None
+        if version == head['version']:
+            return head['graph']
+
+        doc_dir = self._doc_dir(document)
+        start = version - version % SNAPSHOT_INTERVAL
+        graph_data = None
+        if start > 0:
+            graph_data = self._read(os.path.join(doc_dir, 'versions', f'v{start}.snapshot.json'))
+        if graph_data is None:
+            start, graph_data = 0, empty_graph()
+
+        for v in range(start + 1, version + 1):
+            record = self._read(os.path.join(doc_dir, 'versions', f'v{v}.json'))
+            graph_data = apply_delta(graph_data, record['delta'])
+        return graph_data
+
+
+def _delta_size(delta):
+    return sum(len(delta[kind][op]) for kind in ('nodes', 'edges') for op in ('added', 'removed', 'changed'))
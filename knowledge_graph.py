@@ -1,10 +1,20 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
 import json
 from dotenv import load_dotenv
 import os
+from collections import defaultdict
+from graph_versions import split_paragraphs, paragraph_fingerprint, patch_graph, empty_graph, META_FIELDS
 
 load_dotenv()
 
+# 增量抽取时每次请求发送的最大字符数（多个段落合并为一批）
+BATCH_CHAR_LIMIT = 8000
+# 新增段落超过该比例时重新生成标题、摘要等元数据
+METADATA_REFRESH_RATIO = 0.5
+# DeepSeek API地址（兼容OpenAI接口，可指向代理或本地测试服务）
+BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
+
 class KnowledgeGraphBuilder:
     """知识图谱构建器"""
 
@@ -16,63 +26,325 @@ class KnowledgeGraphBuilder:
         # 初始化DeepSeek客户端（使用OpenAI SDK，因为API兼容）
         self.client = OpenAI(
             api_key=self.api_key,
-            base_url="https://api.deepseek.com"
+            base_url=BASE_URL
+        )
+        # 异步客户端：异步服务模式（asgi.py）下等待LLM时不占用线程
+        self.async_client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=BASE_URL
         )
 
     def build(self, text):
         """
-        从文本构建知识图谱
+        从文本构建知识图谱（不保存版本，与增量构建使用同一套按段落抽取的流程）
+
+        Args:
+            text: 输入文本
+
+        Returns:
+            dict: 知识图谱数据，失败时返回None
+        """
+        pending = {}
+        for paragraph in split_paragraphs(text):
+            pending.setdefault(paragraph_fingerprint(paragraph), paragraph)
+        if not pending:
+            return None
+
+        result = self.extract_paragraphs(list(pending.items()), with_metadata=True)
+        if result is None:
+            return None
+        extractions, metadata = result
+
+        graph_data = patch_graph(empty_graph(), set(), list(pending), extractions)
+        graph_data.update(metadata or {})
+        return self._validate_and_clean(graph_data)
+
+    def build_incremental(self, text, store, document):
+        """
+        增量构建知识图谱：只对新增或修改过的段落调用LLM
 
         Args:
             text: 输入文本
+            store: VersionedGraphStore
+            document: 文档名称（版本按文档区分）
+
+        Returns:
+            tuple: (图谱数据, 构建信息)，失败时图谱数据为None
+        """
+        with store.lock(document):
+            plan = self._plan_build(text, store, document)
+            result = None
+            if plan['requests']:
+                result = self.extract_paragraphs(plan['requests'], with_metadata=plan['refresh_metadata'])
+                if result is None:
+                    return None, {}
+            return self._finish_build(plan, result, store, document)
+
+    async def build_incremental_async(self, text, store, document):
+        """
+        build_incremental 的异步版本：LLM请求使用异步客户端，文件读写在线程中执行
+
+        同一文档的构建通过 store.async_lock 串行执行；等待LLM期间事件循环可以处理其他请求。
+        """
+        async with store.async_lock(document):
+            plan = await asyncio.to_thread(self._plan_build, text, store, document)
+            result = None
+            if plan['requests']:
+                result = await self.extract_paragraphs_async(
+                    plan['requests'], with_metadata=plan['refresh_metadata']
+                )
+                if result is None:
+                    return None, {}
+            return await asyncio.to_thread(self._finish_build, plan, result, store, document)
+
+    def _plan_build(self, text, store, document):
+        """切分段落，找出需要重新抽取的段落，并判断是否需要重新生成元数据"""
+        paragraphs = split_paragraphs(text)
+        fingerprints = [paragraph_fingerprint(p) for p in paragraphs]
+        head = store.head(document)
+        extractions = store.get_extractions(document)
+
+        # 未抽取过的段落（修改后的段落指纹会变化）
+        pending = {}
+        for fp, paragraph in zip(fingerprints, paragraphs):
+            if fp not in extractions and fp not in pending:
+                pending[fp] = paragraph
+
+        old_fingerprints = set(head['paragraphs']) if head else set()
+        added = list(dict.fromkeys(fp for fp in fingerprints if fp not in old_fingerprints))
+        removed = old_fingerprints - set(fingerprints)
+
+        # 首次构建或大部分段落都变了（实际上是另一篇文档）时重新生成元数据
+        refresh_metadata = head is None or len(added) > METADATA_REFRESH_RATIO * len(fingerprints)
+        requests = list(pending.items())
+        if refresh_metadata and not requests:
+            # 段落都已抽取过（如恢复到旧版本的内容），用文档开头的段落单独生成元数据
+            batches = self._make_batches(list(zip(fingerprints, paragraphs)))
+            requests = batches[0] if batches else []
+
+        return {
+            'fingerprints': fingerprints,
+            'head': head,
+            'extractions': extractions,
+            'pending': pending,
+            'added': added,
+            'removed': removed,
+            'refresh_metadata': refresh_metadata,
+            'requests': requests
+        }
+
+    def _finish_build(self, plan, result, store, document):
+        """合并抽取结果，更新图谱并保存新版本"""
+        fingerprints, head, extractions = plan['fingerprints'], plan['head'], plan['extractions']
+        added, removed = plan['added'], plan['removed']
+
+        metadata = None
+        if result is not None:
+            contributions, metadata = result
+            # 只为单独生成元数据而抽取的段落不覆盖已有的抽取结果
+            extractions.update({fp: c for fp, c in contributions.items() if fp in plan['pending']})
+            if plan['pending']:
+                store.save_extractions(document, extractions)
+
+        graph_data = patch_graph(head['graph'] if head else empty_graph(), removed, added, extractions)
+        if plan['refresh_metadata']:
+            # 丢弃上一版本的元数据，缺少的字段由 _validate_and_clean 补默认值
+            for field in META_FIELDS:
+                graph_data.pop(field, None)
+            graph_data.update(metadata or {})
+        # 记录来源文件，同一文档重新构建时复用语义布局
+        graph_data['source'] = document
+        graph_data = self._validate_and_clean(graph_data)
+
+        stats = {
+            'paragraphs': len(fingerprints),
+            'reextracted': len(plan['pending']),
+            'added_paragraphs': len(added),
+            'removed_paragraphs': len(removed),
+            'metadata_refreshed': plan['refresh_metadata']
+        }
+        version = store.commit(document, graph_data, fingerprints, stats)
+
+        return graph_data, dict(stats, version=version)
+
+    def extract_paragraphs(self, paragraphs, with_metadata=False):
+        """
+        按段落抽取实体和关系，多个段落合并为一次请求
+
+        Args:
+            paragraphs: [(段落指纹, 段落文本)] 列表
+            with_metadata: 是否同时生成标题、摘要等元数据（首次构建时）
 
         Returns:
-            dict: 知识图谱数据
+            tuple: ({段落指纹: {'nodes', 'edges'}}, 元数据)，失败时返回None
         """
-        system_prompt = """
-        作为知识图谱构建专家，请从文本中提取实体及其关系，并输出以下结构的JSON：
-        {
+        results = []
+        for i, batch in enumerate(self._make_batches(paragraphs)):
+            result = self._extract_batch(batch, with_metadata=with_metadata and i == 0)
+            if result is None:
+                return None
+            results.append(result)
+        return self._merge_batches(results)
+
+    async def extract_paragraphs_async(self, paragraphs, with_metadata=False):
+        """extract_paragraphs 的异步版本，各批次并发请求"""
+        results = await asyncio.gather(*(
+            self._extract_batch_async(batch, with_metadata=with_metadata and i == 0)
+            for i, batch in enumerate(self._make_batches(paragraphs))
+        ))
+        if any(result is None for result in results):
+            return None
+        return self._merge_batches(results)
+
+    def _make_batches(self, paragraphs):
+        batches = []
+        batch, size = [], 0
+        for fp, paragraph in paragraphs:
+            if batch and size + len(paragraph) > BATCH_CHAR_LIMIT:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append((fp, paragraph))
+            size += len(paragraph)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _merge_batches(self, results):
+        contributions = {}
+        metadata = None
+        for batch_contributions, batch_metadata in results:
+            contributions.update(batch_contributions)
+            metadata = metadata or batch_metadata
+        return contributions, metadata
+
+    def _extract_batch(self, batch, with_metadata=False):
+        """对一批段落调用LLM，结果按段落编号拆分"""
+        try:
+            response = self.client.chat.completions.create(**self._batch_request(batch, with_metadata))
+            result = json.loads(response.choices[0].message.content)
+        except Exception as e:
+            print(f"Error extracting paragraphs: {str(e)}")
+            return None
+        return self._parse_batch(batch, result, with_metadata)
+
+    async def _extract_batch_async(self, batch, with_metadata=False):
+        """_extract_batch 的异步版本"""
+        try:
+            response = await self.async_client.chat.completions.create(**self._batch_request(batch, with_metadata))
+            result = json.loads(response.choices[0].message.content)
+        except Exception as e:
+            print(f"Error extracting paragraphs: {str(e)}")
+            return None
+        return self._parse_batch(batch, result, with_metadata)
+
+    def _batch_request(self, batch, with_metadata):
+        """构造一批段落的LLM请求参数"""
+        metadata_prompt = """
             "theme": 文本的主题,
             "title": 知识图谱的标题,
             "abstract": 文本摘要,
             "aspects": [文本的各个角度，可以从结构或内容分析],
             "reader": 对文本读者的分析,
             "purpose": 这张图对读者的帮助,
-            "purposes": [各种具体的帮助],
-            "nodes": [{"id": 唯一ID, "name": 实体名称, "type": 实体类型, "description": 实体描述}],
-            "edges": [{"source": 起点ID, "target": 终点ID, "relation": 关系描述, "weight": 关系强度(1-10)}]
-        }
+            "purposes": [各种具体的帮助],""" if with_metadata else ""
+
+        system_prompt = f"""
+        作为知识图谱构建专家，请从文本中提取实体及其关系。文本由若干段落组成，每个段落以 [P编号] 开头。
+        请逐段输出该段落中出现的实体和关系，输出以下结构的JSON：
+        {{{metadata_prompt}
+            "paragraphs": [
+                {{
+                    "paragraph": 段落编号,
+                    "nodes": [{{"name": 实体名称, "type": 实体类型, "description": 实体描述}}],
+                    "edges": [{{"source": 起点实体名称, "target": 终点实体名称, "relation": 关系描述, "weight": 关系强度(1-10)}}]
+                }}
+            ]
+        }}
         要求：
         1. 实体类型简短如[人物/组织/地点/概念/事件]
         2. 关系描述用动宾结构
-        3. 确保图结构的连通性
-        4. 提取足够多的实体(至少10个)和关系
+        3. 同一实体在不同段落中使用完全相同的名称
+        4. 关系写在描述该关系的段落中，起点和终点可以是任意段落 nodes 中的实体；确保图结构的连通性
         5. 为每个关系标注强度weight(1-10)
         6. 为每个实体添加简短描述
         """
 
-        try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": text}
-                ],
-                timeout=120,  # 设置120秒超时
-                response_format={"type": "json_object"}
-            )
+        text = '\n\n'.join(f'[P{i + 1}] {paragraph}' for i, (_, paragraph) in enumerate(batch))
 
-            result = response.choices[0].message.content
-            graph_data = json.loads(result)
+        return {
+            'model': "deepseek-chat",
+            'messages': [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": text}
+            ],
+            'timeout': 120,  # 设置120秒超时
+            'response_format': {"type": "json_object"}
+        }
 
-            # 数据验证和清理
-            graph_data = self._validate_and_clean(graph_data)
+    def _parse_batch(self, batch, result, with_metadata):
+        """
+        把LLM返回结果按段落编号拆分
+
+        关系的两端可以是同一批次中不同段落的实体。关系记录在它所依赖的每个段落上
+        （描述关系的段落及两端实体出现的段落），任一段落保留时关系都会保留。
+        """
+        # 没有抽取到内容的段落也要记录，避免下次重复抽取
+        contributions = {fp: {'nodes': [], 'edges': []} for fp, _ in batch}
+        # 实体名称 -> 出现该实体的段落指纹
+        mentions = defaultdict(list)
+        stated_edges = []
+        for item in result.get('paragraphs', []):
+            try:
+                index = int(item.get('paragraph')) - 1
+            except (TypeError, ValueError):
+                continue
+            if not 0 <= index < len(batch):
+                continue
+            fp = batch[index][0]
+            nodes = self._clean_nodes(item.get('nodes', []))
+            contributions[fp]['nodes'] = nodes
+            for node in nodes:
+                mentions[node['name']].append(fp)
+            stated_edges.extend((fp, edge) for edge in item.get('edges', []))
 
-            return graph_data
+        for fp, edge in stated_edges:
+            edge = self._clean_edge(edge, mentions)
+            if edge is None:
+                continue
+            for dependency in dict.fromkeys([fp] + mentions[edge['source']] + mentions[edge['target']]):
+                if edge not in contributions[dependency]['edges']:
+                    contributions[dependency]['edges'].append(edge)
 
-        except Exception as e:
-            print(f"Error building knowledge graph: {str(e)}")
+        metadata = None
+        if with_metadata:
+            metadata = {field: result[field] for field in META_FIELDS if field in result}
+        return contributions, metadata
+
+    def _clean_nodes(self, items):
+        """清理单个段落的实体：按名称去重"""
+        nodes = {}
+        for node in items:
+            name = str(node.get('name', '')).strip()
+            if name and name not in nodes:
+                nodes[name] = {
+                    'name': name,
+                    'type': node.get('type') or '概念',
+                    'description': node.get('description', '')
+                }
+        return list(nodes.values())
+
+    def _clean_edge(self, edge, mentions):
+        """清理关系：两端必须是本批次抽取到的实体，否则返回None"""
+        source = str(edge.get('source', '')).strip()
+        target = str(edge.get('target', '')).strip()
+        if source not in mentions or target not in mentions or not edge.get('relation'):
             return None
+        return {
+            'source': source,
+            'target': target,
+            'relation': edge['relation'],
+            'weight': edge.get('weight', 5)
+        }
 
     def _validate_and_clean(self, graph_data):
         """验证和清理图谱数据"""
@@ -0,0 +1,173 @@
+"""
+异步服务模式压测：用本地模拟的LLM服务代替DeepSeek，测试单个进程能同时处理的构建请求数
+
+    python load_test.py --builds 300 --latency 2
+
+脚本在临时目录中启动模拟LLM服务和 `uvicorn asgi:application`（单进程），上传若干文档后
+并发调用 /api/build_graph，统计模拟LLM同时收到的请求数峰值、请求耗时和吞吐。
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class StubLLM:
+    """兼容OpenAI接口的模拟LLM：固定延迟后按 [P编号] 段落返回抽取结果"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        text = body['messages'][-1]['content']
+        paragraphs = []
+        for number, paragraph in re.findall(r'\[P(\d+)\] (.*)', text):
+            names = paragraph.split()[:3]
+            paragraphs.append({
+                'paragraph': int(number),
+                'nodes': [{'name': name, 'type': '概念', 'description': ''} for name in names],
+                'edges': [
+                    {'source': a, 'target': b, 'relation': '关联', 'weight': 5}
+                    for a, b in zip(names, names[1:])
+                ]
+            })
+        content = {'title': '压测文档', 'theme': '压测', 'paragraphs': paragraphs}
+
+        return JSONResponse({
+            'id': f'stub-{self.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'deepseek-chat'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': json.dumps(content, ensure_ascii=False)},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        })
+
+    def app(self):
+        return Starlette(routes=[Route('/chat/completions', self.chat_completions, methods=['POST'])])
+
+
+def write_documents(upload_dir, count, paragraphs):
+    """生成互不相同的测试文档，保证每次构建都需要调用LLM"""
+    os.makedirs(upload_dir, exist_ok=True)
+    filenames = []
+    for i in range(count):
+        filename = f'loadtest_{i:04d}.txt'
+        lines = [f'文档{i}实体{j} 文档{i}实体{j + 1} 文档{i}实体{j + 2}' for j in range(paragraphs)]
+        with open(os.path.join(upload_dir, filename), 'w', encoding='utf-8') as f:
+            f.write('\n\n'.join(lines))
+        filenames.append(filename)
+    return filenames
+
+
+async def wait_until_ready(client, url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f'服务未能在 {timeout} 秒内启动：{url}')
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix='cognigraph-loadtest-')
+    filenames = write_documents(os.path.join(workdir, 'uploads'), args.builds, args.paragraphs)
+
+    stub = StubLLM(args.latency)
+    stub_server = uvicorn.Server(uvicorn.Config(
+        stub.app(), host='127.0.0.1', port=args.stub_port, log_level='warning', backlog=4096
+    ))
+    stub_task = asyncio.create_task(stub_server.serve())
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+        DEEPSEEK_API_KEY='stub',
+        DEEPSEEK_BASE_URL=f'http://127.0.0.1:{args.stub_port}'
+    )
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1',
+             '--port', str(args.port), '--log-level', 'warning', '--backlog', '4096'],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+            await wait_until_ready(client, base_url + '/')
+
+            async def build(filename):
+                start = time.perf_counter()
+                response = await client.post(base_url + '/api/build_graph', json={'filename': filename})
+                return response.status_code, time.perf_counter() - start
+
+            print(f'并发构建 {args.builds} 个文档，模拟LLM延迟 {args.latency}s ...')
+            start = time.perf_counter()
+            results = await asyncio.gather(*(build(f) for f in filenames))
+            elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        stub_server.should_exit = True
+        await stub_task
+
+    latencies = sorted(t for _, t in results)
+    succeeded = sum(1 for status, _ in results if status == 200)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    print(f'成功 {succeeded}/{len(results)}，总耗时 {elapsed:.2f}s，吞吐 {len(results) / elapsed:.1f} 构建/秒')
+    print(f'模拟LLM收到 {stub.requests} 个请求，同时处理中的请求峰值 {stub.peak}')
+    print(f'请求耗时 p50 {percentile(0.5):.2f}s  p95 {percentile(0.95):.2f}s  最大 {latencies[-1]:.2f}s')
+    print(f'服务日志：{log_path}')
+    return 0 if succeeded == len(results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CogniGraph 异步服务模式压测')
+    parser.add_argument('--builds', type=int, default=300, help='并发构建的文档数')
+    parser.add_argument('--latency', type=float, default=2.0, help='模拟LLM的响应延迟（秒）')
+    parser.add_argument('--paragraphs', type=int, default=3, help='每个文档的段落数')
+    parser.add_argument('--port', type=int, default=8765, help='被测服务端口')
+    parser.add_argument('--stub-port', type=int, default=8766, help='模拟LLM端口')
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
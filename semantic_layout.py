@@ -0,0 +1,174 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.utils.extmath import randomized_svd
+
+
+class SemanticLayout:
+    """
+    稳定的增量语义布局
+
+    投影只在首次使用（或新增节点过多）时用随机SVD拟合一次，之后新节点直接用
+    已保存的投影矩阵定位，已有节点位置保持不变。重新拟合时可用Procrustes
+    对齐到上一次的布局，避免整体旋转、翻转。
+    """
+
+    def __init__(self, dimensions=2, refit_ratio=0.5, align=True, random_state=42):
+        if dimensions not in (2, 3):
+            raise ValueError("dimensions must be 2 or 3")
+        self.dimensions = dimensions
+        self.refit_ratio = refit_ratio
+        self.align = align
+        self.random_state = random_state
+
+        # 投影：pos = (x - mean) @ projection + offset
+        self.mean = None
+        self.projection = None
+        self.offset = np.zeros(dimensions)
+        self.fitted_count = 0
+        self.added_since_fit = 0
+        # 节点名称 -> 坐标
+        self.positions = {}
+        self._lock = threading.Lock()
+
+    def layout(self, names, embed, prune=False):
+        """
+        获取名称列表对应的坐标
+
+        Args:
+            names: 节点名称列表
+            embed: 编码函数，参数为名称列表，返回词向量矩阵（只对新名称调用）
+            prune: 是否丢弃不在 names 中的已有位置（names 为完整图谱时使用）
+
+        Returns:
+            np.ndarray: 形状为 (len(names), dimensions) 的坐标
+        """
+        with self._lock:
+            new_names = list(dict.fromkeys(n for n in names if n not in self.positions))
+            if new_names:
+                if self._needs_refit(len(new_names)):
+                    # 重新拟合需要全部词向量；已缓存的名称不会重复编码
+                    all_names = list(dict.fromkeys(list(self.positions) + new_names))
+                    self._refit(all_names, embed(all_names))
+                else:
+                    self._place(new_names, embed(new_names))
+
+            if prune and len(self.positions) > len(names):
+                keep = set(names)
+                self.positions = {n: p for n, p in self.positions.items() if n in keep}
+
+            return np.array([self.positions[n] for n in names]).reshape(len(names), self.dimensions)
+
+    def _needs_refit(self, num_new):
+        if self.projection is None or self.fitted_count <= self.dimensions:
+            return True
+        return self.added_since_fit + num_new > self.refit_ratio * self.fitted_count
+
+    def _place(self, names, embeddings):
+        """用已保存的投影定位新节点，代价与新节点数成正比"""
+        coords = (embeddings - self.mean) @ self.projection + self.offset
+        for name, coord in zip(names, coords):
+            self.positions[name] = coord
+        self.added_since_fit += len(names)
+
+    def _refit(self, names, embeddings):
+        """随机SVD拟合投影，并（可选）对齐到上一次布局"""
+        mean = embeddings.mean(axis=0)
+        centered = embeddings - mean
+        n_components = min(self.dimensions, *centered.shape)
+
+        projection = np.zeros((embeddings.shape[1], self.dimensions))
+        if n_components > 0:
+            _, _, vt = randomized_svd(centered, n_components=n_components, random_state=self.random_state)
+            # 固定符号：每个主成分中绝对值最大的分量取正
+            signs = np.sign(vt[np.arange(n_components), np.argmax(np.abs(vt), axis=1)])
+            signs[signs == 0] = 1
+            projection[:, :n_components] = (vt * signs[:, None]).T
+
+        coords = centered @ projection
+        offset = np.zeros(self.dimensions)
+
+        previous = [i for i, n in enumerate(names) if n in self.positions]
+        if self.align and len(previous) > self.dimensions:
+            old = np.array([self.positions[names[i]] for i in previous])
+            rotation, scale, source_mean, target_mean = _procrustes(coords[previous], old)
+            # 将对齐变换并入投影，之后新增节点自动处于同一坐标系
+            projection = projection @ rotation * scale
+            offset = target_mean - source_mean @ rotation * scale
+            coords = centered @ projection + offset
+
+        self.mean = mean
+        self.projection = projection
+        self.offset = offset
+        self.fitted_count = len(names)
+        self.added_since_fit = 0
+        self.positions = dict(zip(names, coords))
+
+
+def _procrustes(source, target):
+    """正交Procrustes：求旋转、缩放使 source 尽量贴合 target"""
+    source_mean = source.mean(axis=0)
+    target_mean = target.mean(axis=0)
+    a = source - source_mean
+    b = target - target_mean
+    u, sigma, vt = np.linalg.svd(a.T @ b)
+    rotation = u @ vt
+    norm = (a ** 2).sum()
+    scale = sigma.sum() / norm if norm > 0 else 1.0
+    return rotation, scale, source_mean, target_mean
+
+
+def blend_with_structure(positions, adjacency, weight=0.3, iterations=10):
+    """
+    结构感知混合：把每个节点向其邻居的平均位置拉近
+
+    Args:
+        positions: 形状为 (n, d) 的语义坐标
+        adjacency: 形状为 (n, n) 的稀疏邻接矩阵（无向）
+        weight: 结构权重，0 为纯语义布局
+        iterations: 平滑迭代次数
+
+    Returns:
+        np.ndarray: 混合后的坐标
+    """
+    if weight <= 0 or positions.shape[0] == 0:
+        return positions
+
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    has_neighbors = degree > 0
+    inv_degree = np.zeros_like(degree, dtype=float)
+    inv_degree[has_neighbors] = 1.0 / degree[has_neighbors]
+
+    current = positions.copy()
+    for _ in range(iterations):
+        neighbor_mean = (adjacency @ current) * inv_degree[:, None]
+        current = np.where(
+            has_neighbors[:, None],
+            (1 - weight) * positions + weight * neighbor_mean,
+            positions
+        )
+    return current
+
+
+class SemanticLayoutStore:
+    """按图谱来源保存语义布局，同一文档重新构建后布局保持稳定"""
+
+    def __init__(self, max_layouts=64):
+        self.max_layouts = max_layouts
+        self._layouts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, dimensions):
+        with self._lock:
+            layout = self._layouts.get((key, dimensions))
+            if layout is None:
+                layout = SemanticLayout(dimensions=dimensions)
+                self._layouts[(key, dimensions)] = layout
+            self._layouts.move_to_end((key, dimensions))
+            while len(self._layouts) > self.max_layouts:
+                self._layouts.popitem(last=False)
+            return layout
+
+
+layout_store = SemanticLayoutStore()
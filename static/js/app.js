@@ -1,6 +1,7 @@
 // 全局状态
 let state = {
     filename: null,
+    graphId: null,
     graphData: null,
     analyticsData: null
 };
@@ -112,6 +113,7 @@ async function buildGraph() {
         const data = await response.json();
 
         if (data.success) {
+            state.graphId = data.graph_id;
             state.graphData = data.graph_data;
             showStatus('buildStatus', '图谱构建成功！', 'success');
             vizType.disabled = false;
@@ -145,6 +147,7 @@ async function visualize() {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
+                graph_id: state.graphId,
                 graph_data: state.graphData,
                 type: type,
                 layout: layout
@@ -177,16 +180,20 @@ async function analyzeGraph() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ graph_data: state.graphData })
+            // 最多等待5秒，未完成的指标稍后轮询获取
+            body: JSON.stringify({ graph_data: state.graphData, budget: 5 })
         });
 
         const data = await response.json();
 
         if (data.success) {
             state.analyticsData = data.analytics;
-            displayAnalytics(state.analyticsData);
+            displayAnalytics(state.analyticsData, data.pending);
             // 切换到分析结果标签
             document.getElementById('analytics-tab').click();
+            if (data.pending.length > 0) {
+                pollAnalytics(data.graph_id, data.pending);
+            }
         } else {
             alert(`分析失败: ${data.error}`);
         }
@@ -197,6 +204,33 @@ async function analyzeGraph() {
     }
 }
 
+async function pollAnalytics(graphId, pending) {
+    // 定期获取仍在计算中的指标，完成后合并显示
+    while (pending.length > 0) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+
+        const response = await fetch('/api/analytics/result', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ graph_id: graphId, metrics: pending })
+        });
+        const data = await response.json();
+        if (!data.success) return;
+
+        for (const [key, value] of Object.entries(data.analytics)) {
+            if (key === 'centrality' || key === 'basic_stats') {
+                state.analyticsData[key] = Object.assign({}, state.analyticsData[key], value);
+            } else {
+                state.analyticsData[key] = value;
+            }
+        }
+        pending = data.pending;
+        displayAnalytics(state.analyticsData, pending);
+    }
+}
+
 function displayVisualization(path, type) {
     const container = document.getElementById('visualizationContainer');
 
@@ -313,11 +347,15 @@ function displayGraphInfo(graphData) {
     container.innerHTML = html;
 }
 
-function displayAnalytics(analytics) {
+function displayAnalytics(analytics, pending = []) {
     const container = document.getElementById('analyticsContainer');
 
     let html = '<div class="analytics-results">';
 
+    if (pending.length > 0) {
+        html += `<div class="status-message status-info">以下指标仍在计算中: ${pending.join(', ')}</div>`;
+    }
+
     // 基本统计
     if (analytics.basic_stats) {
         const stats = analytics.basic_stats;
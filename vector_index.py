@@ -0,0 +1,470 @@
+import json
+import os
+import threading
+import traceback
+
+import numpy as np
+from scipy import sparse
+
+from graph_index import normalize_name
+
+# 实体数不超过该值时直接全量扫描，超过后训练倒排索引（IVF）
+BRUTE_FORCE_LIMIT = 10000
+# 倒排列表数上限；列表数取 4*sqrt(实体数)
+MAX_LISTS = 4096
+# 实体数超过上次训练时的多少倍后重新训练聚类中心
+RETRAIN_FACTOR = 4
+# 训练时每个聚类中心的采样数和迭代次数
+TRAIN_SAMPLES_PER_LIST = 16
+TRAIN_ITERATIONS = 8
+# 全量扫描和重新分配列表时每批处理的向量数
+SCAN_CHUNK = 8192
+# 出现记录文件的行数超过有效记录数的多少倍后重写（清除已被新版本替换的记录）
+COMPACT_FACTOR = 2
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _train_centroids(sample, num_lists, random_state=42):
+    """球面k-means：以内积为相似度，聚类中心归一化"""
+    rng = np.random.default_rng(random_state)
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+    for _ in range(TRAIN_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        one_hot = sparse.csr_matrix(
+            (np.ones(len(sample), dtype=np.float32), (assignment, np.arange(len(sample)))),
+            shape=(num_lists, len(sample))
+        )
+        sums = np.asarray(one_hot @ sample)
+        counts = np.bincount(assignment, minlength=num_lists)
+        # 空聚类重新随机取一个样本作为中心
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _assign(vectors, centroids):
+    """把向量分配到最近的聚类中心"""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SCAN_CHUNK):
+        chunk = np.asarray(vectors[start:start + SCAN_CHUNK], dtype=np.float32)
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def _inverted_lists(assignment, num_lists):
+    """由每个向量所属的列表编号构建倒排列表：列表编号 -> 向量编号数组"""
+    order = np.argsort(assignment, kind='stable').astype(np.int32)
+    bounds = np.searchsorted(assignment[order], np.arange(num_lists + 1))
+    return [order[bounds[i]:bounds[i + 1]] for i in range(num_lists)]
+
+
+class EntityVectorIndex:
+    """
+    跨图谱的实体向量索引
+
+    每个不同的实体名称（归一化后）保存一条归一化的 float16 向量，并记录它出现在
+    哪些图谱中。出现记录按图谱的来源文档（graph_data['source']）区分：同一文档
+    重新构建后只保留最新版本图谱的记录，旧版本的记录被替换。向量存放在内存映射文件中，近似最近邻检索使用本地实现的倒排索引
+    （IVF）：查询只扫描与查询最接近的 nprobe 个聚类中的向量。
+
+    目录结构（outputs/vectors/）：
+        meta.json          向量维度、上次训练时的向量数
+        vectors.f16        向量矩阵（内存映射，按需扩容）
+        entities.jsonl     每行一个实体名称，行号即向量编号
+        occurrences.jsonl  实体出现记录（向量编号、图谱ID、实体ID、类型）和
+                           文档当前版本记录（文档、图谱ID），按追加顺序重放
+        ivf.npy            聚类中心
+        lists.i32          每个向量所属的倒排列表
+
+    索引只支持单个进程写入；同一进程内的多线程读写是安全的。训练聚类中心在后台线程
+    中进行，期间写入和查询照常使用旧索引（或全量扫描），训练完成后再发布新的倒排列表。
+    """
+
+    def __init__(self, output_dir='outputs', nprobe=8):
+        self.base_dir = os.path.join(output_dir, 'vectors')
+        os.makedirs(self.base_dir, exist_ok=True)
+        self.nprobe = nprobe
+        # 写入串行执行；_lock 只在发布新状态、查询读取状态时短暂持有
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+        self.dim = None
+        self.count = 0
+        self._vectors = None
+        self._capacity = 0
+        self.names = []
+        self._rows = {}            # 归一化名称 -> 向量编号
+        self.occurrences = []      # 向量编号 -> [(图谱ID, 实体ID, 类型)]
+        self.graph_ids = set()     # 仍是某个文档当前版本的图谱
+        self._documents = {}       # 文档 -> 当前版本的图谱ID
+        self._graph_rows = {}      # 图谱ID -> 该图谱出现的向量编号
+        self._live = 0             # 有效的出现记录数
+        self._log_lines = 0        # occurrences.jsonl 的行数
+        self.centroids = None
+        self.trained_count = 0
+        self._lists = []           # 倒排列表：列表编号 -> 向量编号数组
+        self._training = None      # 正在进行的训练线程
+
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def _load(self):
+        meta_path = self._path('meta.json')
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+
+        # 以实体名称文件为准：中断时写了一半的最后一行会被忽略
+        with open(self._path('entities.jsonl'), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    name = json.loads(line)['name']
+                except json.JSONDecodeError:
+                    break
+                self._rows[normalize_name(name)] = len(self.names)
+                self.names.append(name)
+                self.occurrences.append([])
+        self.count = len(self.names)
+
+        # 按写入顺序重放：文档的新版本记录会丢弃旧版本图谱的出现记录
+        by_graph = {}
+        occurrences_path = self._path('occurrences.jsonl')
+        if os.path.exists(occurrences_path):
+            with open(occurrences_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if isinstance(record, dict):
+                            document, graph_id = record['document'], record['graph_id']
+                        else:
+                            row, graph_id, node_id, node_type = record
+                    except (json.JSONDecodeError, KeyError, ValueError):
+                        break
+                    self._log_lines += 1
+                    if isinstance(record, dict):
+                        previous = self._documents.get(document)
+                        self._documents[document] = graph_id
+                        if previous not in (None, graph_id) and previous not in self._documents.values():
+                            by_graph.pop(previous, None)
+                    elif row < self.count:
+                        by_graph.setdefault(graph_id, []).append((row, node_id, node_type))
+
+        for graph_id, items in by_graph.items():
+            # 旧格式没有文档记录，每个图谱视为独立的文档
+            if graph_id not in self._documents.values():
+                self._documents[graph_id] = graph_id
+            self.graph_ids.add(graph_id)
+            self._graph_rows[graph_id] = list(dict.fromkeys(row for row, _, _ in items))
+            for row, node_id, node_type in items:
+                self.occurrences[row].append((graph_id, node_id, node_type))
+            self._live += len(items)
+
+        self._capacity = os.path.getsize(self._path('vectors.f16')) // (self.dim * 2)
+        self._vectors = np.memmap(self._path('vectors.f16'), dtype=np.float16, mode='r+',
+                                  shape=(self._capacity, self.dim))
+
+        if os.path.exists(self._path('ivf.npy')):
+            self.centroids = np.load(self._path('ivf.npy'))
+            self.trained_count = meta.get('trained_count', self.count)
+            # 分配文件缺失（首次训练在写入聚类中心后中断）或与聚类中心不匹配时重新分配全部向量
+            assignment = np.empty(0, dtype=np.int32)
+            if os.path.exists(self._path('lists.i32')):
+                assignment = np.fromfile(self._path('lists.i32'), dtype=np.int32)[:self.count]
+                if len(assignment) and assignment.max() >= len(self.centroids):
+                    assignment = np.empty(0, dtype=np.int32)
+            if len(assignment) < self.count:
+                start = len(assignment)
+                assignment = np.concatenate([assignment, _assign(self._vectors[start:self.count], self.centroids)])
+                self._write_assignment(assignment)
+            self._lists = _inverted_lists(assignment, len(self.centroids))
+
+    def _write_meta(self):
+        with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'trained_count': self.trained_count}, f)
+
+    def _ensure_capacity(self, needed):
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity * 2, 1024)
+        with open(self._path('vectors.f16'), 'ab') as f:
+            f.truncate(capacity * self.dim * 2)
+        # 旧的映射仍然有效，正在进行的查询不受影响
+        vectors = np.memmap(self._path('vectors.f16'), dtype=np.float16, mode='r+',
+                            shape=(capacity, self.dim))
+        with self._lock:
+            self._vectors = vectors
+        self._capacity = capacity
+
+    def _write_assignment(self, assignment):
+        tmp_path = self._path(f'lists.i32.{os.getpid()}.tmp')
+        assignment.astype(np.int32).tofile(tmp_path)
+        os.replace(tmp_path, self._path('lists.i32'))
+
+    def _write_centroids(self, centroids):
+        tmp_path = self._path(f'ivf.{os.getpid()}.tmp.npy')
+        np.save(tmp_path, centroids)
+        os.replace(tmp_path, self._path('ivf.npy'))
+
+    def _start_training(self, count):
+        """在后台线程中训练前 count 个向量的聚类中心，调用方需持有 _write_lock"""
+        self._training = threading.Thread(target=self._train, args=(count,), daemon=True,
+                                          name='vector-index-train')
+        self._training.start()
+
+    def _train(self, count):
+        """
+        训练（或重新训练）聚类中心并重新分配前 count 个向量（在后台线程中执行）
+
+        聚类和分配不持有任何锁，期间写入和查询照常使用旧索引；完成后在写锁内补充
+        分配训练开始后新增的向量，再发布新的聚类中心和倒排列表。
+        """
+        try:
+            with self._lock:
+                vectors = self._vectors
+            num_lists = int(min(MAX_LISTS, 4 * np.sqrt(count)))
+            rng = np.random.default_rng(42)
+            sample_size = min(count, num_lists * TRAIN_SAMPLES_PER_LIST)
+            sample_rows = np.sort(rng.choice(count, sample_size, replace=False))
+            sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+            centroids = _train_centroids(sample, num_lists)
+            assignment = _assign(vectors[:count], centroids)
+
+            with self._write_lock:
+                current = self.count
+                if current > count:
+                    added = _assign(self._vectors[count:current], centroids)
+                    assignment = np.concatenate([assignment, added])
+                # 先写聚类中心再写分配：在两次写入之间中断时，加载时可能是新聚类中心配旧分配
+                # （召回率下降，直到下次训练）或没有分配文件（加载时重新分配全部向量）
+                self._write_centroids(centroids)
+                self._write_assignment(assignment)
+                lists = _inverted_lists(assignment, num_lists)
+                with self._lock:
+                    self.centroids = centroids
+                    self._lists = lists
+                self.trained_count = count
+                self._write_meta()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._training = None
+
+    def wait_for_training(self, timeout=None):
+        """等待正在进行的后台训练完成"""
+        training = self._training
+        if training is not None:
+            training.join(timeout)
+
+    def _drop_graph(self, graph_id):
+        """删除图谱的出现记录（已不是任何文档的当前版本），调用方需持有 _write_lock"""
+        self.graph_ids.discard(graph_id)
+        for row in self._graph_rows.pop(graph_id, []):
+            kept = [o for o in self.occurrences[row] if o[0] != graph_id]
+            self._live -= len(self.occurrences[row]) - len(kept)
+            # 整体替换列表，正在进行的查询看到的仍是旧列表
+            self.occurrences[row] = kept
+
+    def _compact_occurrences(self):
+        """重写出现记录文件，只保留各文档当前版本的记录，调用方需持有 _write_lock"""
+        tmp_path = self._path(f'occurrences.jsonl.{os.getpid()}.tmp')
+        lines = 0
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for graph_id, rows in self._graph_rows.items():
+                for row in rows:
+                    for occurrence in self.occurrences[row]:
+                        if occurrence[0] == graph_id:
+                            f.write(json.dumps([row, *occurrence], ensure_ascii=False) + '\n')
+                            lines += 1
+            for document, graph_id in self._documents.items():
+                f.write(json.dumps({'document': document, 'graph_id': graph_id}, ensure_ascii=False) + '\n')
+                lines += 1
+        os.replace(tmp_path, self._path('occurrences.jsonl'))
+        self._log_lines = lines
+
+    def _add_entities(self, graph_id, graph_data, embed):
+        """写入图谱中新实体的向量和全部出现记录，调用方需持有 _write_lock"""
+        new_names = {}
+        for node in graph_data.get('nodes', []):
+            name = str(node.get('name', '')).strip()
+            key = normalize_name(name)
+            if key and key not in self._rows and key not in new_names:
+                new_names[key] = name
+
+        start = len(self.names)
+        if new_names:
+            vectors = _normalize(embed(list(new_names.values())))
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f'词向量维度 {vectors.shape[1]} 与索引维度 {self.dim} 不一致')
+
+            # 先写向量，再写名称：名称文件决定有效的向量数
+            self._ensure_capacity(start + len(vectors))
+            self._vectors[start:start + len(vectors)] = vectors
+            self._vectors.flush()
+            with open(self._path('entities.jsonl'), 'a', encoding='utf-8') as f:
+                for key, name in new_names.items():
+                    self._rows[key] = len(self.names)
+                    self.names.append(name)
+                    self.occurrences.append([])
+                    f.write(json.dumps({'name': name}, ensure_ascii=False) + '\n')
+
+        rows = []
+        with open(self._path('occurrences.jsonl'), 'a', encoding='utf-8') as f:
+            for node in graph_data.get('nodes', []):
+                key = normalize_name(str(node.get('name', '')).strip())
+                if not key:
+                    continue
+                row = self._rows[key]
+                occurrence = (graph_id, node.get('id'), node.get('type', ''))
+                # 整体替换列表，正在进行的查询看到的仍是旧列表
+                self.occurrences[row] = self.occurrences[row] + [occurrence]
+                f.write(json.dumps([row, *occurrence], ensure_ascii=False) + '\n')
+                rows.append(row)
+        self._graph_rows[graph_id] = list(dict.fromkeys(rows))
+        self._live += len(rows)
+        self._log_lines += len(rows)
+        self.graph_ids.add(graph_id)
+
+    def add_graph(self, graph_id, graph_data, embed):
+        """
+        把图谱中的实体加入索引
+
+        图谱成为其来源文档（graph_data['source']，缺省为图谱ID）的当前版本，
+        同一文档上一版本图谱的出现记录被删除；同一图谱只索引一次。
+
+        Args:
+            graph_id: 图谱ID
+            graph_data: 图谱数据
+            embed: 编码函数，参数为名称列表，返回词向量矩阵（只对新名称调用）
+
+        Returns:
+            int: 新增的向量数
+        """
+        document = graph_data.get('source') or graph_id
+        with self._write_lock:
+            previous = self._documents.get(document)
+            if previous == graph_id:
+                return 0
+
+            start = self.count
+            # 内容相同的图谱可能已作为其他文档的当前版本被索引
+            if graph_id not in self.graph_ids:
+                self._add_entities(graph_id, graph_data, embed)
+
+            # 先写出现记录，再写文档版本记录：中断时上一版本仍是当前版本
+            with open(self._path('occurrences.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'document': document, 'graph_id': graph_id}, ensure_ascii=False) + '\n')
+            self._log_lines += 1
+            self._documents[document] = graph_id
+            if previous is not None and previous not in self._documents.values():
+                self._drop_graph(previous)
+            if self._log_lines > COMPACT_FACTOR * (self._live + len(self._documents)) + 1024:
+                self._compact_occurrences()
+
+            count = len(self.names)
+            if self._training is None and count > BRUTE_FORCE_LIMIT and (
+                    self.centroids is None or count > RETRAIN_FACTOR * self.trained_count):
+                self._start_training(count)
+
+            # 训练期间新增的向量先按旧聚类中心分配（尚未训练过则查询全量扫描），
+            # 训练完成时会按新聚类中心重新分配
+            lists = self._lists
+            if self.centroids is not None and count > start:
+                added = _assign(self._vectors[start:count], self.centroids)
+                with open(self._path('lists.i32'), 'ab') as f:
+                    added.tofile(f)
+                # 复制后再修改，正在进行的查询看到的仍是旧列表
+                lists = list(lists)
+                rows = np.arange(start, count, dtype=np.int32)
+                for list_id in np.unique(added):
+                    lists[list_id] = np.concatenate([lists[list_id], rows[added == list_id]])
+            with self._lock:
+                self._lists = lists
+                self.count = count
+            return count - start
+
+    def search(self, query_vector, k=10, nprobe=None, filter_fn=None):
+        """
+        检索与查询向量最相似的实体
+
+        Args:
+            query_vector: 查询词向量
+            k: 返回数量
+            nprobe: 扫描的倒排列表数（越大越准确、越慢）
+            filter_fn: 可选，参数为出现记录 (图谱ID, 实体ID, 类型)，返回是否保留
+
+        Returns:
+            list: [{'name', 'score', 'occurrences'}]，按相似度降序
+        """
+        with self._lock:
+            count = self.count
+            vectors = self._vectors
+            centroids = self.centroids
+            lists = list(self._lists)
+        if not count:
+            return []
+
+        query = _normalize(np.asarray(query_vector).reshape(1, -1))[0]
+        if centroids is None:
+            candidates = None
+            scores = np.concatenate([
+                np.asarray(vectors[start:min(start + SCAN_CHUNK, count)], dtype=np.float32) @ query
+                for start in range(0, count, SCAN_CHUNK)
+            ])
+        else:
+            nprobe = min(nprobe or self.nprobe, len(centroids))
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            candidates = np.sort(np.concatenate([lists[i] for i in probe]))
+            candidates = candidates[candidates < count]
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+
+        # 有过滤条件时多取一些候选，过滤后再截取前k个
+        fetch = min(len(scores), k * 4 if filter_fn else k)
+        if fetch == 0:
+            return []
+        top = np.argpartition(-scores, fetch - 1)[:fetch]
+        top = top[np.argsort(-scores[top])]
+
+        results = []
+        for i in top:
+            row = int(candidates[i]) if candidates is not None else int(i)
+            occurrences = self.occurrences[row]
+            if filter_fn:
+                occurrences = [o for o in occurrences if filter_fn(o)]
+                if not occurrences:
+                    continue
+            results.append({
+                'name': self.names[row],
+                'score': round(float(scores[i]), 4),
+                'occurrences': [
+                    {'graph_id': graph_id, 'node_id': node_id, 'type': node_type}
+                    for graph_id, node_id, node_type in occurrences
+                ]
+            })
+            if len(results) == k:
+                break
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entities': self.count,
+                'graphs': len(self.graph_ids),
+                'dim': self.dim,
+                'lists': 0 if self.centroids is None else len(self.centroids),
+                'training': self._training is not None
+            }
@@ -6,45 +6,138 @@ import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 import seaborn as sns
 from wordcloud import WordCloud
-from sentence_transformers import SentenceTransformer
-from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
+import plotly
+import plotly.offline
 import numpy as np
+import gzip
+import hashlib
+import io
 import os
+import threading
 import warnings
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+from embeddings import get_embedding_cache
+from graph_store import compute_graph_id
+from semantic_layout import SemanticLayout, blend_with_structure, layout_store
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 支持的布局算法
+LAYOUT_TYPES = ('semantic', 'semantic_structural', 'spring', 'circular', 'kamada_kawai', 'spectral')
+
+# 语义+结构混合布局中结构所占的权重
+STRUCTURE_WEIGHT = 0.3
+
+# 候选中文字体（按优先级）
+CHINESE_FONTS = [
+    'SimHei', 'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB',
+    'WenQuanYi Micro Hei', 'Source Han Sans CN', 'Noto Sans CJK SC'
+]
+
+# 词云支持的输出格式
+WORDCLOUD_FORMATS = {'png': 'PNG', 'webp': 'WEBP'}
+
+# 预压缩级别：共享资源只写一次，使用最高压缩率；每次请求生成的页面使用中等级别，避免拖慢请求
+ASSET_COMPRESSION = {'gzip': 9, 'brotli': 11}
+PAGE_COMPRESSION = {'gzip': 6, 'brotli': 5}
+
+_plotly_asset_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def find_chinese_font():
+    """
+    查找系统中可用的中文字体（每个进程只查找一次）
+
+    Returns:
+        tuple: (字体名称, 字体文件路径)，未找到时为 (None, None)
+    """
+    installed = {f.name: f.fname for f in fm.fontManager.ttflist}
+    for font_name in CHINESE_FONTS:
+        if font_name in installed and os.path.exists(installed[font_name]):
+            return font_name, installed[font_name]
+    return None, None
+
+
+@lru_cache(maxsize=1)
+def setup_matplotlib_font():
+    """设置matplotlib中文字体（修改pyplot全局配置，每个进程只执行一次）"""
+    font_name, _ = find_chinese_font()
+    if font_name:
+        plt.rcParams['font.family'] = font_name
+        plt.rcParams['axes.unicode_minus'] = False
+        return
+
+    warnings.warn("未找到中文字体，可能无法正确显示中文")
+
+
+def precompress(path, levels=ASSET_COMPRESSION):
+    """
+    为静态文件生成 .gz（以及可用时的 .br）预压缩副本，供服务端按 Accept-Encoding 直接返回
+
+    Args:
+        path: 文件路径
+        levels: 压缩级别 {'gzip': 1-9, 'brotli': 0-11}
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    variants = [('.gz', lambda d: gzip.compress(d, compresslevel=levels['gzip'], mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', lambda d: brotli.compress(d, quality=levels['brotli'])))
+
+    for suffix, compress in variants:
+        tmp_path = f'{path}{suffix}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(compress(data))
+        os.replace(tmp_path, path + suffix)
+
+
+def ensure_plotly_asset(output_dir):
+    """
+    将 plotly.js 写入本地共享资源目录（每个版本只写一次）
+
+    文件名带版本号，内容不会变化，因此可以长期缓存。
+
+    Returns:
+        str: 页面中引用该脚本的URL
+    """
+    filename = f'plotly-{plotly.__version__}.min.js'
+    asset_dir = os.path.join(output_dir, 'assets')
+    path = os.path.join(asset_dir, filename)
+
+    with _plotly_asset_lock:
+        if not os.path.exists(path):
+            os.makedirs(asset_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(plotly.offline.get_plotlyjs())
+            os.replace(tmp_path, path)
+            precompress(path)
+
+    return f'/{output_dir}/assets/{filename}'
+
 
 class GraphVisualizer:
     """图谱可视化器"""
 
-    def __init__(self, output_dir='outputs'):
+    def __init__(self, output_dir='outputs', plotly_js_url=None):
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
-        self.setup_matplotlib_font()
-        # 延迟加载模型
-        self._model = None
+        # 未指定时使用 output_dir/assets 下的共享 plotly.js
+        self.plotly_js_url = plotly_js_url or ensure_plotly_asset(output_dir)
+        # 进程内共享的词向量缓存（模型延迟加载）
+        self.embeddings = get_embedding_cache()
 
     @property
     def model(self):
         """延迟加载词向量模型"""
-        if self._model is None:
-            self._model = SentenceTransformer('./model')
-        return self._model
-
-    def setup_matplotlib_font(self):
-        """设置matplotlib中文字体"""
-        chinese_fonts = [
-            'SimHei', 'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB',
-            'WenQuanYi Micro Hei', 'Source Han Sans CN', 'Noto Sans CJK SC'
-        ]
-        fonts = [f.name for f in fm.fontManager.ttflist]
-
-        for font in chinese_fonts:
-            if font in fonts:
-                plt.rcParams['font.family'] = font
-                plt.rcParams['axes.unicode_minus'] = False
-                return
-
-        warnings.warn("未找到中文字体，可能无法正确显示中文")
+        return self.embeddings.model
 
     def _build_networkx_graph(self, graph_data):
         """构建NetworkX图"""
@@ -70,6 +163,12 @@ class GraphVisualizer:
 
         return G
 
+    def _write_html(self, fig, output_file, post_script=None):
+        """保存Plotly图表：引用共享的本地plotly.js，页面只包含图表数据"""
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        fig.write_html(output_file, include_plotlyjs=self.plotly_js_url, post_script=post_script)
+        precompress(output_file, PAGE_COMPRESSION)
+
     def _get_node_colors(self, G):
         """获取节点颜色"""
         color_map = {
@@ -87,26 +186,36 @@ class GraphVisualizer:
 
         return colors
 
-    def _get_semantic_layout(self, G, dimensions=2):
-        """使用词向量生成语义布局"""
+    def _get_semantic_layout(self, G, dimensions=2, layout_key=None, structure_weight=0.0, prune=False):
+        """
+        使用词向量生成语义布局
+
+        同一 layout_key（图谱来源文档）的布局会被保留：已有实体位置不变，新实体用已拟合的
+        投影直接定位。prune 为 True（G 是完整图谱）时丢弃已不在图谱中的实体位置。
+        structure_weight > 0 时再按图结构把相连实体拉近。
+        """
         node_names = [G.nodes[node]['name'] for node in G.nodes()]
-        embeddings = self.model.encode(node_names)
-
-        if dimensions == 2:
-            pca = PCA(n_components=2)
-            positions = pca.fit_transform(embeddings)
-        elif dimensions == 3:
-            pca = PCA(n_components=3)
-            positions = pca.fit_transform(embeddings)
+
+        if layout_key is None:
+            semantic_layout = SemanticLayout(dimensions=dimensions)
         else:
-            raise ValueError("dimensions must be 2 or 3")
+            semantic_layout = layout_store.get(layout_key, dimensions)
+        positions = semantic_layout.layout(node_names, self.embeddings.encode, prune=prune)
+
+        if structure_weight > 0 and G.number_of_edges() > 0:
+            adjacency = nx.to_scipy_sparse_array(G.to_undirected(), nodelist=list(G.nodes()), weight=None)
+            positions = blend_with_structure(positions, adjacency, weight=structure_weight)
 
         return {node: positions[i] for i, node in enumerate(G.nodes())}
 
-    def _get_layout(self, G, layout_type='semantic'):
+    def _get_layout(self, G, layout_type='semantic', layout_key=None, prune=False):
         """获取图布局"""
         if layout_type == 'semantic':
-            return self._get_semantic_layout(G, dimensions=2)
+            return self._get_semantic_layout(G, dimensions=2, layout_key=layout_key, prune=prune)
+        elif layout_type == 'semantic_structural':
+            return self._get_semantic_layout(
+                G, dimensions=2, layout_key=layout_key, structure_weight=STRUCTURE_WEIGHT, prune=prune
+            )
         elif layout_type == 'spring':
             return nx.spring_layout(G, k=1, iterations=50)
         elif layout_type == 'circular':
@@ -118,10 +227,16 @@ class GraphVisualizer:
         else:
             return nx.spring_layout(G)
 
-    def create_interactive_2d(self, graph_data, layout='semantic'):
+    @staticmethod
+    def _layout_key(graph_data):
+        """语义布局的复用键：图谱来源文档（document_key）；没有来源的图谱不复用布局"""
+        return graph_data.get('source')
+
+    def create_interactive_2d(self, graph_data, layout='semantic', filename='interactive_2d.html',
+                              post_script=None):
         """创建交互式2D可视化（使用Plotly）"""
         G = self._build_networkx_graph(graph_data)
-        pos = self._get_layout(G, layout)
+        pos = self._get_layout(G, layout, self._layout_key(graph_data), prune=not graph_data.get('subgraph'))
 
         # 准备边数据
         edge_trace = []
@@ -204,14 +319,21 @@ class GraphVisualizer:
                         ))
 
         # 保存文件
-        output_file = os.path.join(self.output_dir, 'interactive_2d.html')
-        fig.write_html(output_file)
+        output_file = os.path.join(self.output_dir, filename)
+        self._write_html(fig, output_file, post_script)
         return output_file
 
-    def create_interactive_3d(self, graph_data, layout='semantic'):
+    def create_interactive_3d(self, graph_data, layout='semantic', filename='interactive_3d.html',
+                              post_script=None):
         """创建交互式3D可视化"""
         G = self._build_networkx_graph(graph_data)
-        pos_3d = self._get_semantic_layout(G, dimensions=3)
+        pos_3d = self._get_semantic_layout(
+            G,
+            dimensions=3,
+            layout_key=self._layout_key(graph_data),
+            structure_weight=STRUCTURE_WEIGHT if layout == 'semantic_structural' else 0.0,
+            prune=not graph_data.get('subgraph')
+        )
 
         # 准备边数据
         edge_x = []
@@ -284,17 +406,233 @@ class GraphVisualizer:
                             height=800
                         ))
 
-        output_file = os.path.join(self.output_dir, 'interactive_3d.html')
-        fig.write_html(output_file)
+        output_file = os.path.join(self.output_dir, filename)
+        self._write_html(fig, output_file, post_script)
+        return output_file
+
+    def create_community_overview(self, graph_data, aggregates, graph_id, dimensions=2, layout='semantic'):
+        """
+        创建分层（LOD）总览图：每个社区聚合为一个超级节点
+
+        超级节点大小表示成员数，社区间的边按边数聚合为边束。
+        点击超级节点时向服务端请求该社区的内部子图并跳转显示。
+
+        Args:
+            graph_data: 图谱数据
+            aggregates: GraphAnalytics.community_aggregates 的结果
+            graph_id: 图谱ID
+            dimensions: 2 或 3
+            layout: 展开社区时使用的布局
+
+        Returns:
+            str: 输出文件路径
+        """
+        if dimensions not in (2, 3):
+            raise ValueError("dimensions must be 2 or 3")
+        if layout not in LAYOUT_TYPES:
+            raise ValueError(f"unknown layout: {layout}")
+
+        output_file = os.path.join(self.output_dir, 'lod', graph_id, f'overview_{dimensions}d_{layout}.html')
+        if os.path.exists(output_file):
+            return output_file
+
+        communities = aggregates['communities']
+        bundles = aggregates['bundles']
+
+        # 社区图布局：边束越多的社区靠得越近
+        C = nx.Graph()
+        C.add_nodes_from(c['community_id'] for c in communities)
+        for bundle in bundles:
+            C.add_edge(bundle['source'], bundle['target'], weight=bundle['count'])
+        pos = nx.spring_layout(C, dim=dimensions, weight='weight', seed=42)
+
+        # 边束按边数分档合并为少量trace，避免社区很多时trace数量爆炸
+        max_count = max([b['count'] for b in bundles], default=1)
+        num_bins = 5
+        binned = [[] for _ in range(num_bins)]
+        for bundle in bundles:
+            level = min(int(np.log1p(bundle['count']) / np.log1p(max_count) * num_bins), num_bins - 1)
+            binned[level].append(bundle)
+
+        scatter = go.Scatter3d if dimensions == 3 else go.Scatter
+        axes = ['x', 'y', 'z'][:dimensions]
+
+        traces = []
+        for level, level_bundles in enumerate(binned):
+            if not level_bundles:
+                continue
+            coords = {axis: [] for axis in axes}
+            for bundle in level_bundles:
+                p0, p1 = pos[bundle['source']], pos[bundle['target']]
+                for i, axis in enumerate(axes):
+                    coords[axis].extend([p0[i], p1[i], None])
+            traces.append(scatter(
+                mode='lines',
+                line=dict(width=1 + level * 2, color='#888'),
+                hoverinfo='none',
+                showlegend=False,
+                **coords
+            ))
+
+        # 边束中点用于悬停显示边数
+        mid = {axis: [] for axis in axes}
+        mid_text = []
+        names = {c['community_id']: c['label'] for c in communities}
+        for bundle in bundles:
+            p0, p1 = pos[bundle['source']], pos[bundle['target']]
+            for i, axis in enumerate(axes):
+                mid[axis].append((p0[i] + p1[i]) / 2)
+            mid_text.append(f"{names[bundle['source']]} ↔ {names[bundle['target']]}<br>关系数: {bundle['count']}")
+        traces.append(scatter(
+            mode='markers',
+            marker=dict(size=4, color='#888', opacity=0.3),
+            hovertext=mid_text,
+            hoverinfo='text',
+            showlegend=False,
+            **mid
+        ))
+
+        # 超级节点
+        max_size = max([c['size'] for c in communities], default=1)
+        node_coords = {axis: [] for axis in axes}
+        node_text = []
+        for c in communities:
+            p = pos[c['community_id']]
+            for i, axis in enumerate(axes):
+                node_coords[axis].append(p[i])
+            types = '、'.join(f'{t}({n})' for t, n in list(c['types'].items())[:3])
+            node_text.append(
+                f"<b>社区 {c['community_id']}: {c['label']}</b><br>"
+                f"实体数: {c['size']}<br>"
+                f"内部关系: {c['internal_edges']}<br>"
+                f"主要类型: {types}<br>"
+                f"核心实体: {'、'.join(c['top_nodes'])}<br>"
+                f"<i>点击展开</i>"
+            )
+        base_size = 12 if dimensions == 3 else 20
+        traces.append(scatter(
+            mode='markers+text',
+            text=[c['label'] for c in communities],
+            textposition='top center',
+            hovertext=node_text,
+            hoverinfo='text',
+            customdata=[c['community_id'] for c in communities],
+            marker=dict(
+                size=[base_size + 40 * np.sqrt(c['size'] / max_size) for c in communities],
+                color=[c['size'] for c in communities],
+                colorscale='Viridis',
+                line=dict(width=2, color='white')
+            ),
+            showlegend=False,
+            **node_coords
+        ))
+
+        hidden_axis = dict(showgrid=False, zeroline=False, showticklabels=False)
+        title = f"{graph_data.get('title', '知识图谱')} - 社区总览（{len(communities)} 个社区）"
+        if dimensions == 3:
+            fig_layout = go.Layout(
+                title=title,
+                showlegend=False,
+                hovermode='closest',
+                scene=dict(xaxis=hidden_axis, yaxis=hidden_axis, zaxis=hidden_axis),
+                height=800
+            )
+        else:
+            fig_layout = go.Layout(
+                title=dict(text=title, x=0.5, xanchor='center'),
+                showlegend=False,
+                hovermode='closest',
+                margin=dict(b=20, l=5, r=5, t=40),
+                xaxis=hidden_axis,
+                yaxis=hidden_axis,
+                plot_bgcolor='white',
+                height=800
+            )
+        fig = go.Figure(data=traces, layout=fig_layout)
+
+        post_script = """
+        var gd = document.getElementById('{plot_id}');
+        gd.on('plotly_click', function (event) {
+            var point = event.points[0];
+            if (point.customdata === undefined) return;
+            fetch('/api/visualize/community', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify({
+                    graph_id: '%s',
+                    community_id: point.customdata,
+                    dimensions: %d,
+                    layout: '%s'
+                })
+            }).then(function (r) { return r.json(); }).then(function (data) {
+                if (data.success) {
+                    window.location.href = '/' + data.path;
+                } else {
+                    alert('展开社区失败: ' + data.error);
+                }
+            });
+        });
+        """ % (graph_id, dimensions, layout)
+
+        self._write_html(fig, output_file, post_script)
         return output_file
 
+    def create_community_detail(self, graph_data, aggregates, graph_id, community_id,
+                                dimensions=2, layout='semantic'):
+        """
+        渲染单个社区的内部子图（分层可视化中点击超级节点后展开）
+
+        Returns:
+            str: 输出文件路径，社区不存在时返回None
+        """
+        if layout not in LAYOUT_TYPES:
+            raise ValueError(f"unknown layout: {layout}")
+        if not any(c['community_id'] == community_id for c in aggregates['communities']):
+            return None
+
+        filename = os.path.join('lod', graph_id, f'community_{community_id}_{dimensions}d_{layout}.html')
+        output_file = os.path.join(self.output_dir, filename)
+        if os.path.exists(output_file):
+            return output_file
+
+        membership = aggregates['membership']
+        nodes = [n for n in graph_data['nodes'] if membership.get(str(n['id'])) == community_id]
+        member_ids = {n['id'] for n in nodes}
+        edges = [e for e in graph_data['edges'] if e['source'] in member_ids and e['target'] in member_ids]
+
+        label = next(c['label'] for c in aggregates['communities'] if c['community_id'] == community_id)
+        subgraph_data = {
+            'title': f"{graph_data.get('title', '知识图谱')} - 社区 {community_id}: {label}",
+            # 与完整图谱共用语义布局，展开后实体位置保持一致
+            'source': self._layout_key(graph_data),
+            # 只是完整图谱的一部分，不能据此清理布局中的实体
+            'subgraph': True,
+            'nodes': nodes,
+            'edges': edges
+        }
+
+        # 返回总览的链接
+        overview = f"/{self.output_dir}/lod/{graph_id}/overview_{dimensions}d_{layout}.html"
+        post_script = """
+        var back = document.createElement('a');
+        back.href = '%s';
+        back.textContent = '← 返回社区总览';
+        back.style.cssText = 'position:fixed;top:8px;left:12px;z-index:10;font:14px sans-serif;';
+        document.body.appendChild(back);
+        """ % overview
+
+        if dimensions == 3:
+            return self.create_interactive_3d(subgraph_data, layout, filename=filename, post_script=post_script)
+        return self.create_interactive_2d(subgraph_data, layout, filename=filename, post_script=post_script)
+
     def create_similarity_heatmap(self, graph_data):
         """创建实体语义相似度热力图"""
+        setup_matplotlib_font()
         G = self._build_networkx_graph(graph_data)
         node_names = [G.nodes[node]['name'] for node in G.nodes()]
 
         # 计算词向量
-        embeddings = self.model.encode(node_names)
+        embeddings = self.embeddings.encode(node_names)
 
         # 计算相似度矩阵
         from sklearn.metrics.pairwise import cosine_similarity
@@ -325,8 +663,37 @@ class GraphVisualizer:
 
         return output_file
 
-    def create_entity_wordcloud(self, graph_data):
-        """创建实体词云"""
+    def create_entity_wordcloud(self, graph_data, size=(12, 8), dpi=100, fmt='png'):
+        """
+        创建实体词云
+
+        直接由 WordCloud.to_image() 生成图片，不经过pyplot全局状态，可在多线程中并发调用。
+        输出文件按图谱内容、标题、尺寸和格式区分（wordcloud/<graph_id>/...），
+        不同请求互不覆盖，相同参数直接复用已生成的图片。
+
+        Args:
+            graph_data: 图谱数据
+            size: 图片尺寸（英寸）
+            dpi: 每英寸像素数
+            fmt: 输出格式，'png' 或 'webp'
+
+        Returns:
+            str: 输出文件路径
+        """
+        if fmt not in WORDCLOUD_FORMATS:
+            raise ValueError(f"unsupported format: {fmt}")
+
+        width = max(int(size[0] * dpi), 100)
+        height = max(int(size[1] * dpi), 100)
+        title = f"{graph_data.get('title', '知识图谱')} - 实体词云"
+        title_digest = hashlib.sha1(title.encode('utf-8')).hexdigest()[:8]
+        output_file = os.path.join(
+            self.output_dir, 'wordcloud', compute_graph_id(graph_data),
+            f'{width}x{height}_{dpi}dpi_{title_digest}.{fmt}'
+        )
+        if os.path.exists(output_file):
+            return output_file
+
         G = self._build_networkx_graph(graph_data)
 
         # 根据节点度数生成词频
@@ -334,37 +701,51 @@ class GraphVisualizer:
         for node in G.nodes(data=True):
             word_freq[node[1]['name']] = G.degree(node[0]) + 1
 
+        # 以不超过 1200x800 的画布排版，再按比例放大，高分辨率时排版开销不变
+        scale = max(1.0, width / 1200, height / 800)
+        font_path = self._get_chinese_font_path()
+
         # 生成词云
         wordcloud = WordCloud(
-            font_path=self._get_chinese_font_path(),
-            width=1200,
-            height=800,
+            font_path=font_path,
+            width=int(width / scale),
+            height=int(height / scale),
+            scale=scale,
             background_color='white',
             colormap='viridis',
             relative_scaling=0.5,
             min_font_size=10
         ).generate_from_frequencies(word_freq)
-
-        # 保存图片
-        plt.figure(figsize=(15, 10))
-        plt.imshow(wordcloud, interpolation='bilinear')
-        plt.title(f"{graph_data.get('title', '知识图谱')} - 实体词云", fontsize=16, pad=20)
-        plt.axis('off')
-        plt.tight_layout()
-
-        output_file = os.path.join(self.output_dir, 'entity_wordcloud.png')
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
-        plt.close()
+        cloud = wordcloud.to_image()
+
+        # 在顶部绘制标题
+        font_size = max(int(cloud.height * 0.035), 12)
+        try:
+            title_font = ImageFont.truetype(font_path, font_size) if font_path else ImageFont.load_default()
+        except OSError:
+            title_font = ImageFont.load_default()
+        band = font_size * 2
+        image = Image.new('RGB', (cloud.width, cloud.height + band), 'white')
+        image.paste(cloud, (0, band))
+        draw = ImageDraw.Draw(image)
+        try:
+            draw.text((image.width / 2, band / 2), title, fill='black', font=title_font, anchor='mm')
+        except ValueError:
+            # 旧版Pillow的位图字体不支持anchor
+            draw.text((10, band / 4), title, fill='black', font=title_font)
+
+        # 保存图片：先写入内存再原子替换，避免并发请求读到半写入的文件
+        buffer = io.BytesIO()
+        image.save(buffer, format=WORDCLOUD_FORMATS[fmt], dpi=(dpi, dpi))
+
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        tmp_path = f'{output_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, output_file)
 
         return output_file
 
     def _get_chinese_font_path(self):
         """获取中文字体路径"""
-        chinese_fonts = [
-            'SimHei', 'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB'
-        ]
-        for font_name in chinese_fonts:
-            font_path = fm.findfont(font_name)
-            if font_path and os.path.exists(font_path):
-                return font_path
-        return None
+        return find_chinese_font()[1]